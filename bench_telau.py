@@ -0,0 +1,264 @@
+"""Benchmark and load-test TelegramForwarder against a local fake client
+
+No Telegram account or network is needed. The fake client simulates RPC
+latency, flood waits, write-forbidden chats and upload times, and the
+benchmark reports scheduler throughput, CPU time per send, scheduling jitter,
+memory per target and event-loop lag.
+
+    python bench_telau.py                      # 10, 1k and 50k targets
+    python bench_telau.py --targets 1000 --duration 30 --flood-rate 0.001
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from telethon import errors
+from telethon.tl.types import Photo, User
+
+import telau
+
+
+class FakeMessage:
+    """Just enough of a sent message for the media cache"""
+
+    def __init__(self, photo=None):
+        self.photo = photo
+        self.document = None
+
+
+_PHOTO = Photo(id=1, access_hash=1, file_reference=b"", date=None, sizes=[], dc_id=1)
+
+
+class FakeTelegramClient:
+    """Local stand-in for TelegramClient with configurable behaviour"""
+
+    def __init__(self, targets, latency=0.02, latency_jitter=0.01, flood_rate=0.0,
+                 flood_seconds=2, forbidden_rate=0.0, upload_seconds=0.5, seed=1):
+        self.targets = targets
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.upload_seconds = upload_seconds
+        self.random = random.Random(seed)
+        self.forbidden = {
+            peer_id for peer_id in range(1, targets + 1) if self.random.random() < forbidden_rate
+        }
+        self.send_times = {}  # peer id -> list of monotonic send times
+        self.sends = 0
+        self.errors = 0
+        self.flood_waits = 0
+        self.uploads = 0
+        self.connected = False
+
+    async def _rpc(self, peer_id):
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.latency_jitter))
+        if peer_id in self.forbidden:
+            self.errors += 1
+            raise errors.ChatWriteForbiddenError(None)
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise errors.FloodWaitError(None, capture=self.flood_seconds)
+        self.sends += 1
+        self.send_times.setdefault(peer_id, []).append(time.monotonic())
+
+    async def connect(self):
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def get_me(self, input_peer=False):
+        await asyncio.sleep(self.latency)
+        return User(id=0, access_hash=0)
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def is_user_authorized(self):
+        return True
+
+    async def iter_dialogs(self):
+        for peer_id in range(1, self.targets + 1):
+            yield _FakeDialog(User(id=peer_id, access_hash=peer_id))
+
+    async def get_entity(self, peer_id):
+        await asyncio.sleep(self.latency)
+        if 1 <= peer_id <= self.targets:
+            return User(id=peer_id, access_hash=peer_id)
+        raise ValueError(f"Could not find the input entity for {peer_id}")
+
+    async def send_message(self, entity, message, **kwargs):
+        await self._rpc(entity.user_id)
+
+    async def __call__(self, request):
+        if not hasattr(request, "file_part"):
+            await asyncio.sleep(self.latency)  # e.g. the keepalive ping
+            return None
+        if request.file_part == 0:
+            self.uploads += 1
+        await asyncio.sleep(self.upload_seconds)
+        return True
+
+    async def send_file(self, entity, file, **kwargs):
+        await self._rpc(entity.user_id)
+        return FakeMessage(photo=_PHOTO)
+
+
+class _FakeDialog:
+    def __init__(self, entity):
+        self.entity = entity
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def measure_loop_lag(samples, period=0.01):
+    """Record how late the event loop wakes a short sleep"""
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(period)
+        samples.append(time.monotonic() - start - period)
+
+
+async def run_scenario(targets, args):
+    """Schedule `targets` chats on a fake client and collect the numbers"""
+    client = FakeTelegramClient(
+        targets, latency=args.latency, latency_jitter=args.latency_jitter,
+        flood_rate=args.flood_rate, flood_seconds=args.flood_seconds,
+        forbidden_rate=args.forbidden_rate, upload_seconds=args.upload_seconds,
+    )
+    forwarder = telau.TelegramForwarder(0, "", "bench", client=client)
+    forwarder.scheduler.workers = args.workers
+    forwarder.pipeline = telau.SendPipeline(args.max_in_flight, args.media_slots)
+    forwarder.governor = telau.RateGovernor(rate=args.rate, burst=args.rate, max_rate=args.rate)
+
+    chat_ids = [str(peer_id) for peer_id in range(1, targets + 1)]
+    interval = args.interval
+
+    await forwarder.connection.ensure_connected()
+    if args.image_path and not await forwarder.prepare_media([args.image_path]):
+        raise SystemExit("media preparation failed")
+    start = time.monotonic()
+    await forwarder.validate_chat_ids(chat_ids)
+    resolve_seconds = time.monotonic() - start
+
+    first_due = forwarder.schedule_state.plan((chat_id, interval) for chat_id in chat_ids)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for chat_id in chat_ids:
+        await forwarder.add_chat(chat_id, args.text, args.image_path, interval, first_due[chat_id])
+    memory_per_target = (tracemalloc.get_traced_memory()[0] - before) / targets
+    tracemalloc.stop()
+
+    lag_samples = []
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples))
+    start, cpu_start = time.monotonic(), time.process_time()
+    try:
+        await asyncio.wait_for(forwarder.run_schedule(), args.duration)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.monotonic() - start
+    cpu_seconds = time.process_time() - cpu_start
+    lag_task.cancel()
+
+    # Jitter: how far each gap between two sends to one chat strays from the interval
+    jitter = []
+    for times in client.send_times.values():
+        jitter.extend(abs(later - earlier - interval) for earlier, later in zip(times, times[1:]))
+
+    return {
+        "targets": targets,
+        "interval_s": interval,
+        "resolve_s": round(resolve_seconds, 3),
+        "sends": client.sends,
+        "throughput_per_s": round(client.sends / elapsed, 1),
+        "expected_per_s": round(targets / interval, 1),
+        "cpu_per_send_us": round(cpu_seconds / max(1, client.sends) * 1e6, 1),
+        "errors": client.errors,
+        "flood_waits": client.flood_waits,
+        "uploads": client.uploads,
+        "jitter_p50_ms": round(percentile(jitter, 0.5) * 1000, 1),
+        "jitter_p99_ms": round(percentile(jitter, 0.99) * 1000, 1),
+        "jitter_max_ms": round(max(jitter, default=0) * 1000, 1),
+        "sched_lag_avg_ms": round((forwarder.metrics.snapshot()["avg_scheduler_lag"] or 0) * 1000, 2),
+        "memory_per_target_bytes": round(memory_per_target),
+        "loop_lag_p50_ms": round(percentile(lag_samples, 0.5) * 1000, 2),
+        "loop_lag_p99_ms": round(percentile(lag_samples, 0.99) * 1000, 2),
+        "loop_lag_max_ms": round(max(lag_samples, default=0) * 1000, 2),
+    }
+
+
+def print_table(results):
+    """One row per metric, one column per scenario"""
+    label_width = max(len(column) for column in results[0]) + 2
+    for column in results[0]:
+        print(f"{column:<{label_width}}" + "".join(f"{result[column]!s:>14}" for result in results))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", type=int, nargs="+", default=[10, 1000, 50000])
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds to run each scenario")
+    parser.add_argument("--interval", type=float, default=5.0, help="send interval per target in seconds")
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--max-in-flight", type=int, default=16, help="pipeline cap on concurrent sends")
+    parser.add_argument("--media-slots", type=int, default=4, help="how many of those may be media sends")
+    parser.add_argument("--rate", type=float, default=1e6, help="governor rate; high by default to measure the scheduler")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated RPC latency in seconds")
+    parser.add_argument("--latency-jitter", type=float, default=0.01)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability of a FloodWaitError per send")
+    parser.add_argument("--flood-seconds", type=int, default=2)
+    parser.add_argument("--forbidden-rate", type=float, default=0.0,
+                        help="fraction of targets that raise ChatWriteForbiddenError")
+    parser.add_argument("--upload-seconds", type=float, default=0.5, help="simulated time per uploaded file part")
+    parser.add_argument("--image", action="store_true", help="send a generated image with every message")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+async def bench(args):
+    results = []
+    for targets in args.targets:
+        print(f"⏱️ Benchmarking {targets} target(s) for {args.duration}s...", file=sys.stderr)
+        # Per-send output goes to /dev/null so the terminal doesn't skew the numbers
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results.append(await run_scenario(targets, args))
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.text = "benchmark message"
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+
+    # State files (entity index, media cache...) go to a throwaway directory
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        args.image_path = None
+        if args.image:
+            args.image_path = os.path.join(workdir, "bench.jpg")
+            with open(args.image_path, "wb") as image_file:
+                image_file.write(os.urandom(64 * 1024))
+        results = asyncio.run(bench(args))
+
+    print_table(results)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,1671 @@
 import time
 import asyncio
 import os
-from telethon.sync import TelegramClient
-from telethon import errors
-from telethon.tl.functions.channels import GetForumTopicsRequest
-from telethon.tl.types import Channel
+import json
+import random
+import hashlib
+import mimetypes
+import inspect
+import importlib
+import heapq
+import itertools
+import functools
+from array import array
+import argparse
+import re
+import string
+import sys
+import signal
+import socket
+import threading
+from collections import deque
+
+class LazyModule:
+    """Stand-in for a module that imports it on first attribute access
+
+    Importing Telethon takes a few hundred milliseconds, which commands that
+    never talk to Telegram (ctl, simulate, --help) shouldn't pay for.
+    Looked-up attributes are cached on the stand-in, so later lookups are as
+    cheap as on the module itself.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        setattr(self, attr, value)
+        return value
+
+class LazyErrors:
+    """Class attribute holding a tuple of Telethon error types, looked up on first use"""
+
+    def __init__(self, *names):
+        self.names = names
+
+    def __set_name__(self, owner, attr):
+        self.attr = attr
+
+    def __get__(self, instance, owner):
+        value = tuple(getattr(errors, name) for name in self.names)
+        setattr(owner, self.attr, value)  # Replace the descriptor with the plain tuple
+        return value
+
+telethon_sync = LazyModule("telethon.sync")
+errors = LazyModule("telethon.errors")
+utils = LazyModule("telethon.utils")
+types = LazyModule("telethon.tl.types")
+channel_requests = LazyModule("telethon.tl.functions.channels")
+upload_requests = LazyModule("telethon.tl.functions.upload")
+help_requests = LazyModule("telethon.tl.functions.help")
+
+class StateStore:
+    """Key-value state for the entity index, schedule and media handles in one append-only log
+
+    Changes only touch memory and queue a log line. `flush` appends every
+    queued line in one write and rewrites the log with just the live entries
+    once it has grown well past them. `run` flushes on a timer in a worker
+    thread and once more at shutdown, so sends never wait for the disk.
+    """
+
+    def __init__(self, path, compact_ratio=2.0, compact_min=1000):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self.data = {}  # namespace -> {key: value}
+        self.hooks = []  # called on the event loop before each flush
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._lines = 0
+        if self._load():
+            self.flush(compact=True)  # Rewrite a log whose last write was cut short
+
+    def _load(self):
+        """Replay the log; return True if its last line is incomplete"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    if not line.endswith("\n"):
+                        return True
+                    try:
+                        namespace, key, value = json.loads(line)
+                    except (ValueError, TypeError):
+                        continue
+                    self._lines += 1
+                    table = self.data.setdefault(namespace, {})
+                    if value is None:
+                        table.pop(key, None)
+                    else:
+                        table[key] = value
+        except FileNotFoundError:
+            pass
+        return False
+
+    def table(self, namespace):
+        """Live dict of one namespace; change it only through set and delete"""
+        return self.data.setdefault(namespace, {})
+
+    def set(self, namespace, key, value):
+        # Values are replaced, never changed in place, so a flush in another
+        # thread always sees a consistent one
+        self.data.setdefault(namespace, {})[key] = value
+        self._pending.append((namespace, key, value))
+
+    def delete(self, namespace, key):
+        if self.data.get(namespace, {}).pop(key, None) is not None:
+            self._pending.append((namespace, key, None))
+
+    def flush(self, compact=False):
+        """Write queued changes to disk; safe to run in a worker thread"""
+        with self._lock:
+            lines = []
+            while self._pending:
+                lines.append(json.dumps(self._pending.popleft()))
+            live = sum(map(len, self.data.values()))
+            if compact or self._lines + len(lines) > max(self.compact_min, live * self.compact_ratio):
+                self._compact()  # Everything just drained is already in self.data
+            elif lines:
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write("\n".join(lines) + "\n")
+                self._lines += len(lines)
+
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        lines = 0
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for namespace, table in list(self.data.items()):
+                for key, value in table.copy().items():
+                    file.write(json.dumps([namespace, key, value]) + "\n")
+                    lines += 1
+        os.replace(tmp_path, self.path)
+        self._lines = lines
+
+    def save(self):
+        """Flush right away, e.g. at the end of a command"""
+        for hook in self.hooks:
+            hook()
+        self.flush()
+
+    async def run(self, every=5.0):
+        """Flush periodically until cancelled, then once more"""
+        try:
+            while True:
+                await asyncio.sleep(every)
+                for hook in self.hooks:
+                    hook()
+                await asyncio.to_thread(self.flush)
+        finally:
+            self.save()
+
+class MediaCache:
+    """Upload each media file once and reuse the uploaded handle for every send
+
+    Files are validated and uploaded by `prepare` before any chat is
+    contacted, in parallel parts. The handle Telegram returns with the first
+    sent message is then reused for every chat and kept across restarts.
+    """
+
+    PHOTO_LIMIT = 10 * 1024 * 1024
+    FILE_LIMIT = 2000 * 1024 * 1024
+    BIG_FILE_SIZE = 10 * 1024 * 1024
+    ALBUM_LIMIT = 10
+
+    # Errors meaning the server no longer accepts a cached handle
+    REJECTED_ERRORS = LazyErrors(
+        "FileReferenceExpiredError",
+        "FileReferenceInvalidError",
+        "MediaEmptyError",
+        "FilePartMissingError",
+        "FilePartsInvalidError",
+        "PhotoInvalidError",
+    )
+
+    def __init__(self, client, store, metrics=None, upload_parts=4):
+        self.client = client
+        self.store = store
+        self.metrics = metrics
+        self.upload_parts = upload_parts
+        # content hash -> {"kind", "id", "access_hash", "file_reference"}
+        self.handles = store.table("media")
+        self._digests = {}  # path -> (size, mtime_ns, content hash, md5)
+        self._hashing = {}  # (path, size, mtime_ns) -> hash running in a worker thread
+        self._uploads = {}  # content hash -> InputFile uploaded during this run
+        self._locks = {}
+
+    @classmethod
+    def check_file(cls, path):
+        """Return a problem description if the file can't be sent, else None"""
+        if not os.path.isfile(path):
+            return f"'{path}' not found"
+        size = os.path.getsize(path)
+        if size == 0:
+            return f"'{path}' is empty"
+        if mimetypes.guess_type(path)[0] is None:
+            return f"'{path}' has an unknown file type"
+        if utils.is_image(path) and size > cls.PHOTO_LIMIT:
+            return f"'{path}' is larger than Telegram's 10 MB photo limit"
+        if size > cls.FILE_LIMIT:
+            return f"'{path}' is larger than Telegram's 2000 MB file limit"
+        return None
+
+    @classmethod
+    def check_media(cls, paths):
+        """Return every problem with a list of files to be sent together"""
+        problems = [problem for problem in map(cls.check_file, paths) if problem]
+        if len(paths) > cls.ALBUM_LIMIT:
+            problems.append(f"an album can hold at most {cls.ALBUM_LIMIT} files, got {len(paths)}")
+        return problems
+
+    @staticmethod
+    def _hash_file(path):
+        sha = hashlib.sha256()
+        md5 = hashlib.md5()
+        with open(path, "rb") as media_file:
+            for chunk in iter(lambda: media_file.read(1 << 20), b""):
+                sha.update(chunk)
+                md5.update(chunk)
+        return sha.hexdigest(), md5.hexdigest()
+
+    async def _hashes(self, path):
+        stat = os.stat(path)
+        cached = self._digests.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached
+
+        # Hash in a worker thread, once per file version even when many sends ask at once
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        hashing = self._hashing.get(key)
+        if hashing is None:
+            hashing = self._hashing[key] = asyncio.ensure_future(asyncio.to_thread(self._hash_file, path))
+            hashing.add_done_callback(lambda _: self._hashing.pop(key, None))
+        sha, md5 = await asyncio.shield(hashing)
+        cached = self._digests[path] = (stat.st_size, stat.st_mtime_ns, sha, md5)
+        return cached
+
+    async def digest(self, path):
+        """Return the content hash of a file, rehashing only when it changed on disk"""
+        return (await self._hashes(path))[2]
+
+    def _input_media(self, digest):
+        handle = self.handles.get(digest)
+        if handle is None:
+            return None
+        file_reference = bytes.fromhex(handle["file_reference"])
+        if handle["kind"] == "photo":
+            return types.InputPhoto(handle["id"], handle["access_hash"], file_reference)
+        return types.InputDocument(handle["id"], handle["access_hash"], file_reference)
+
+    def remember(self, digest, message):
+        """Store the server-side handle of media attached to a sent message"""
+        media = getattr(message, "photo", None)
+        kind = "photo"
+        if media is None:
+            media = getattr(message, "document", None)
+            kind = "document"
+        if media is None:
+            return
+        self.store.set("media", digest, {
+            "kind": kind,
+            "id": media.id,
+            "access_hash": media.access_hash,
+            "file_reference": (media.file_reference or b"").hex(),
+        })
+        self._uploads.pop(digest, None)
+
+    def forget(self, digest):
+        """Drop a handle the server rejected so the next send uploads again"""
+        self._uploads.pop(digest, None)
+        self.store.delete("media", digest)
+
+    async def upload(self, path):
+        """Upload a file in parallel parts and return its InputFile"""
+        size, _, _, md5 = await self._hashes(path)
+        part_size = utils.get_appropriated_part_size(size) * 1024
+        parts = (size + part_size - 1) // part_size
+        is_big = size > self.BIG_FILE_SIZE
+        file_id = random.getrandbits(63)
+        semaphore = asyncio.Semaphore(self.upload_parts)
+
+        def read_part(index):
+            with open(path, "rb") as media_file:
+                media_file.seek(index * part_size)
+                return media_file.read(part_size)
+
+        async def upload_part(index):
+            async with semaphore:
+                data = await asyncio.to_thread(read_part, index)
+                if is_big:
+                    request = upload_requests.SaveBigFilePartRequest(file_id, index, parts, data)
+                else:
+                    request = upload_requests.SaveFilePartRequest(file_id, index, data)
+                if not await self.client(request):
+                    raise ValueError(f"Failed to upload part {index} of '{path}'")
+
+        await asyncio.gather(*(upload_part(index) for index in range(parts)))
+        if self.metrics is not None:
+            self.metrics.inc("uploads_total")
+            self.metrics.inc("upload_bytes_total", size)
+        name = os.path.basename(path)
+        if is_big:
+            return types.InputFileBig(file_id, parts, name)
+        return types.InputFile(file_id, parts, name, md5)
+
+    async def _handle(self, path):
+        """Return a reusable handle for a file, uploading it if there is none"""
+        digest = await self.digest(path)
+        handle = self._input_media(digest) or self._uploads.get(digest)
+        if handle is not None:
+            return handle
+        # Only one upload per file even when many chats are due at once
+        async with self._locks.setdefault(digest, asyncio.Lock()):
+            handle = self._input_media(digest) or self._uploads.get(digest)
+            if handle is None:
+                handle = self._uploads[digest] = await self.upload(path)
+            return handle
+
+    async def prepare(self, paths):
+        """Validate and upload files ahead of sending; False if any file is unusable"""
+        problems = self.check_media(paths)
+        for problem in problems:
+            print(f"❌ Media {problem}")
+        if problems:
+            return False
+        try:
+            await asyncio.gather(*(self._handle(path) for path in dict.fromkeys(paths)))
+        except Exception as e:
+            print(f"❌ Media upload failed: {e}")
+            return False
+        return True
+
+    async def send_file(self, media, **send_params):
+        """Send one file or an album, reusing cached handles and re-uploading rejected ones"""
+        paths = [media] if isinstance(media, str) else list(media)
+        digests = [await self.digest(path) for path in paths]
+        for attempt in range(2):
+            handles = [await self._handle(path) for path in paths]
+            try:
+                result = await self.client.send_file(
+                    file=handles[0] if len(handles) == 1 else handles, **send_params
+                )
+                break
+            except self.REJECTED_ERRORS:
+                for digest in digests:
+                    self.forget(digest)
+                if attempt:
+                    raise
+
+        messages = result if isinstance(result, list) else [result]
+        for digest, message in zip(digests, messages):
+            if digest not in self.handles:
+                self.remember(digest, message)
+        return result
+
+class Metrics:
+    """In-memory counters and histograms for the send path
+
+    Recording is a few dict and list updates so it is safe on the hot path.
+    The numbers can be served as Prometheus text over a local HTTP port or
+    appended periodically to a JSONL file.
+    """
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    LAG_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self, per_chat_limit=200):
+        self.counters = {}
+        self.per_chat_limit = per_chat_limit  # above this many chats only the total is exported
+        self.send_latency_total = [0] * (len(self.LATENCY_BUCKETS) + 3)
+        self.send_latency = {}  # chat id -> bucket counts + [sum, count]
+        self.scheduler_lag = [0] * (len(self.LAG_BUCKETS) + 3)
+        self.gauges = {}  # name -> callable returning the current value
+        self.started = time.time()
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @staticmethod
+    def _observe(histogram, buckets, value):
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(buckets)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def observe_send(self, chat_id, seconds):
+        histogram = self.send_latency.get(chat_id)
+        if histogram is None:
+            histogram = self.send_latency[chat_id] = [0] * (len(self.LATENCY_BUCKETS) + 3)
+        self._observe(histogram, self.LATENCY_BUCKETS, seconds)
+        self._observe(self.send_latency_total, self.LATENCY_BUCKETS, seconds)
+        self.inc("sends_total")
+
+    def observe_error(self, error):
+        self.inc("errors_total")
+        self.inc(f"errors_total:{type(error).__name__}")
+
+    def observe_lag(self, seconds):
+        self._observe(self.scheduler_lag, self.LAG_BUCKETS, seconds)
+
+    @staticmethod
+    def _histogram_lines(name, labels, histogram, buckets):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(buckets + ("+Inf",), histogram):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        labels = labels.rstrip(",")
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {histogram[-2]}")
+        lines.append(f"{name}_count{suffix} {histogram[-1]}")
+        return lines
+
+    def render_prometheus(self, gauges=None):
+        """Render every metric in the Prometheus text exposition format
+
+        Safe to run in a worker thread when the gauge values are read on the
+        event loop beforehand and passed in.
+        """
+        if gauges is None:
+            gauges = {name: read() for name, read in self.gauges.items()}
+        lines = [f"telau_uptime_seconds {time.time() - self.started:.0f}"]
+        for name, value in sorted(self.counters.items()):
+            name, _, kind = name.partition(":")
+            label = f'{{type="{kind}"}}' if kind else ""
+            lines.append(f"telau_{name}{label} {value}")
+        for name, value in sorted(gauges.items()):
+            lines.append(f"telau_{name} {value}")
+        lines += self._histogram_lines("telau_scheduler_lag_seconds", "", self.scheduler_lag, self.LAG_BUCKETS)
+        lines += self._histogram_lines(
+            "telau_send_latency_seconds", "", self.send_latency_total, self.LATENCY_BUCKETS
+        )
+        # Per-chat series only while they stay small; 50k chats would be tens of MB per scrape
+        per_chat = list(self.send_latency.items())
+        if len(per_chat) <= self.per_chat_limit:
+            for chat_id, histogram in per_chat:
+                lines += self._histogram_lines(
+                    "telau_chat_send_latency_seconds", f'chat="{chat_id}",', histogram, self.LATENCY_BUCKETS
+                )
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Aggregate view for the JSONL sink"""
+        sends, latency_sum = self.send_latency_total[-1], self.send_latency_total[-2]
+        return {
+            "time": round(time.time(), 3),
+            "counters": dict(self.counters),
+            "gauges": {name: read() for name, read in self.gauges.items()},
+            "targets": len(self.send_latency),
+            "avg_send_latency": round(latency_sum / sends, 4) if sends else None,
+            "avg_scheduler_lag": round(self.scheduler_lag[-2] / self.scheduler_lag[-1], 4)
+            if self.scheduler_lag[-1] else None,
+        }
+
+    async def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics on a local port until cancelled"""
+        async def handle(reader, writer):
+            try:
+                await reader.readline()
+                gauges = {name: read() for name, read in self.gauges.items()}
+                body = (await asyncio.to_thread(self.render_prometheus, gauges)).encode()
+                writer.write(
+                    b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def write_jsonl(self, path, every=10.0):
+        """Append a snapshot to a JSONL file periodically until cancelled"""
+        def append(line):
+            with open(path, "a", encoding="utf-8") as file:
+                file.write(line)
+
+        try:
+            while True:
+                await asyncio.sleep(every)
+                await asyncio.to_thread(append, json.dumps(self.snapshot()) + "\n")
+        finally:
+            append(json.dumps(self.snapshot()) + "\n")
+
+class StatusLog:
+    """Rate-limited status output that keeps printing off the send path
+
+    Messages are queued as a format string plus arguments and formatted and
+    written in batches by a background task. Routine lines (sent, waiting)
+    logged with `routine` are limited to `rate` per second, the excess being
+    dropped and summarised in a single line; warnings and errors logged by
+    calling the log directly are always written. While the dashboard is
+    shown, lines go to `tail` for it to display instead.
+    """
+
+    def __init__(self, rate=20, max_pending=10000, stream=None):
+        self.rate = rate
+        self.stream = stream
+        self.max_pending = max_pending  # routine lines beyond this are dropped on arrival
+        self.pending = deque()
+        self.dropped = 0
+        self.tail = None  # when set to a deque, lines are kept there instead of printed
+        self._task = None
+
+    def __call__(self, message, *args):
+        self._queue(message, args, False)
+
+    def routine(self, message, *args):
+        """Log a line that may be dropped when output is busy"""
+        self._queue(message, args, True)
+
+    def _queue(self, message, args, routine):
+        if self._task is None:
+            print(message.format(*args) if args else message, file=self.stream)
+            return
+        if routine and len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append((time.time(), message, args, routine))
+
+    def _flush(self, limit=None):
+        lines = []
+        routine_left = limit
+        while self.pending:
+            created, message, args, routine = self.pending.popleft()
+            if routine and limit is not None:
+                if routine_left <= 0:
+                    self.dropped += 1
+                    continue
+                routine_left -= 1
+            stamp = time.strftime("%H:%M:%S", time.localtime(created))
+            lines.append(f"[{stamp}] " + (message.format(*args) if args else message))
+        if self.dropped:
+            lines.append(f"… {self.dropped} status message(s) suppressed")
+            self.dropped = 0
+        if lines and self.tail is not None:
+            self.tail.extend(lines)
+        elif lines:
+            stream = self.stream or sys.stdout
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+
+    async def _run(self, period):
+        while True:
+            await asyncio.sleep(period)
+            self._flush(max(1, int(self.rate * period)))
+
+    def start(self, period=0.25):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(period))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._flush()
+
+class SendPipeline:
+    """Cap in-flight RPCs, with separate text and media lanes
+
+    At most `max_in_flight` sends run at once, and at most `media_slots` of
+    them may be media sends, so a large upload can never take the capacity
+    text messages need. When saturated, waiting sends are started in
+    priority order (higher first, then first come first served).
+    """
+
+    def __init__(self, max_in_flight=16, media_slots=4):
+        self.max_in_flight = max_in_flight
+        self.media_slots = media_slots
+        self.in_flight = {"text": 0, "media": 0}
+        self._waiters = {"text": [], "media": []}
+        self._seq = itertools.count()
+
+    def _can_start(self, lane):
+        if sum(self.in_flight.values()) >= self.max_in_flight:
+            return False
+        return lane == "text" or self.in_flight["media"] < self.media_slots
+
+    def queued(self, lane=None):
+        lanes = [lane] if lane else self._waiters
+        return sum(len(self._waiters[name]) for name in lanes)
+
+    def _dispatch(self):
+        while True:
+            best = None
+            for lane, waiters in self._waiters.items():
+                while waiters and waiters[0][2].cancelled():
+                    heapq.heappop(waiters)
+                if waiters and self._can_start(lane) and (best is None or waiters[0] < best[0]):
+                    best = (waiters[0], lane)
+            if best is None:
+                return
+            _, _, future = heapq.heappop(self._waiters[best[1]])
+            self.in_flight[best[1]] += 1
+            future.set_result(None)
+
+    async def acquire(self, lane, priority=0):
+        """Wait for a slot in the given lane"""
+        if not self._waiters[lane] and self._can_start(lane):
+            self.in_flight[lane] += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters[lane], (-priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(lane)  # The slot was granted just as we were cancelled
+            raise
+
+    def release(self, lane):
+        self.in_flight[lane] -= 1
+        self._dispatch()
+
+class MessageTemplate:
+    """Message text with {name} placeholders, parsed once and rendered per target
+
+    Placeholders are filled from a target's variables; {chat} is the chat ID
+    unless a variable overrides it. Literal braces are written {{ and }}.
+    Rendered texts are cached per set of values, so targets that share them
+    share one string. Templates loaded from a file remember its path and
+    mtime so edits can be picked up while sending. A verbatim template
+    sends its text exactly as written, braces included.
+    """
+
+    def __init__(self, source, path=None, mtime_ns=None, verbatim=False):
+        self.source = source
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.verbatim = verbatim
+        self.parts = []  # (literal text, field name or None)
+        for literal, field, spec, conversion in string.Formatter().parse("" if verbatim else source):
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                raise ValueError(f"unsupported placeholder {{{field}{'!' + conversion if conversion else ''}"
+                                 f"{':' + spec if spec else ''}}}; use {{name}}")
+            self.parts.append((literal, field))
+        self.fields = tuple(sorted({field for _, field in self.parts if field is not None}))
+        self._rendered = {}
+
+    @classmethod
+    @functools.lru_cache(maxsize=64)
+    def plain(cls, text):
+        """Template that sends the text exactly as written, braces included"""
+        return cls(text, verbatim=True)
+
+    @classmethod
+    def load(cls, path, verbatim=False):
+        """Compile a message file, or return None after printing why it can't be used"""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        text = read_text_from_file(path)
+        if text is None:
+            return None
+        try:
+            return cls(text, path, mtime_ns, verbatim)
+        except ValueError as e:
+            print(f"❌ Error: File '{path}' is not a valid message template: {e}")
+            return None
+
+    def __eq__(self, other):
+        if not isinstance(other, MessageTemplate):
+            return NotImplemented
+        return (self.source, self.path, self.verbatim) == (other.source, other.path, other.verbatim)
+
+    def __hash__(self):
+        return hash((self.source, self.path, self.verbatim))
+
+    def missing(self, variables):
+        """Placeholders that the given variables leave unfilled"""
+        return [field for field in self.fields if field != "chat" and field not in variables]
+
+    def render(self, chat_id, variables=None):
+        """Fill in the placeholders for one target"""
+        if not self.fields:
+            return self.source
+        values = {"chat": chat_id, **(variables or {})}
+        key = tuple(str(values[field]) for field in self.fields)
+        text = self._rendered.get(key)
+        if text is None:
+            text = "".join(literal + (str(values[field]) if field is not None else "")
+                           for literal, field in self.parts)
+            if "chat" not in self.fields or "chat" in (variables or {}):
+                self._rendered[key] = text  # Per-chat texts would never be shared
+        return text
+
+class ScheduledSend:
+    """A single target's slot in the scheduler"""
+    __slots__ = ("key", "interval", "job", "due", "active")
+
+    def __init__(self, key, interval, job, due):
+        self.key = key
+        self.interval = interval
+        self.job = job
+        self.due = due
+        self.active = True
+
+class SendPlan:
+    """One target compiled for sending: resolved peer, topic, message and lanes
+
+    Built once when a chat is added, so each send only dispatches. Calling
+    the plan starts a send, which makes it the scheduler job for its target.
+    The text is rendered up front and only re-rendered when its template
+    changes.
+    """
+    __slots__ = ("chat_id", "entity", "topic_id", "template", "variables", "text", "media", "lane", "priority",
+                 "interval_label", "send")
+
+    def __init__(self, chat_id, entity, topic_id, template, variables, media, interval, priority, send):
+        self.chat_id = chat_id
+        self.entity = entity
+        self.topic_id = topic_id
+        self.template = template
+        self.variables = variables
+        self.text = template.render(chat_id, variables)
+        self.media = media
+        self.lane = "media" if media else "text"
+        self.priority = priority
+        self.interval_label = format_interval(interval)
+        self.send = send
+
+    def __call__(self):
+        return self.send(self)
+
+class SendScheduler:
+    """Dispatch due sends for every target from one deadline heap
+
+    Deadlines live on a monotonic clock and advance by exactly one interval
+    per send (fixed rate), so send latency never accumulates as drift. Due
+    jobs are handed to a bounded set of workers. A job returns None to stay
+    on its schedule, False to be removed, or a number of seconds after which
+    it should be retried.
+    """
+
+    def __init__(self, workers=64, clock=time.monotonic, metrics=None, log=None):
+        self.clock = clock
+        self.workers = workers
+        self.metrics = metrics
+        self.log = log or StatusLog()
+        self.jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self.paused = False
+        self.draining = False
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def add(self, key, interval, job, first_due=None):
+        """Schedule a job, replacing any job already registered under key"""
+        self.remove(key)
+        due = self.clock() if first_due is None else first_due
+        entry = ScheduledSend(key, interval, job, due)
+        self.jobs[key] = entry
+        self._push(entry)
+        return entry
+
+    def remove(self, key):
+        """Unschedule a job; a send already in flight is allowed to finish"""
+        entry = self.jobs.pop(key, None)
+        if entry is not None:
+            entry.active = False
+            self._wakeup.set()
+        return entry is not None
+
+    def _push(self, entry):
+        heapq.heappush(self._heap, (entry.due, next(self._seq), entry))
+        self._wakeup.set()
+
+    def _reschedule(self, entry, result):
+        if not entry.active:
+            return
+        if result is False:
+            self.remove(entry.key)
+            return
+        now = self.clock()
+        if result is not None:
+            entry.due = now + result
+        else:
+            # Skip ticks that were missed entirely instead of bursting to catch up
+            missed = 0
+            if now > entry.due and entry.interval > 0:
+                missed = int((now - entry.due) // entry.interval)
+            entry.due += (missed + 1) * entry.interval
+        self._push(entry)
+
+    def pause(self):
+        """Stop dispatching; deadlines keep advancing and missed ticks are skipped"""
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self._wakeup.set()
+
+    def drain(self):
+        """Stop dispatching and let run() return once in-flight sends finish"""
+        self.draining = True
+        self._wakeup.set()
+
+    def clear(self):
+        """Forget every job"""
+        for key in list(self.jobs):
+            self.remove(key)
+        self._heap.clear()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    def next_due(self):
+        """Monotonic time of the next dispatch, or None"""
+        while self._heap and not self._heap[0][2].active:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    async def _worker(self):
+        while True:
+            entry = await self._queue.get()
+            if not entry.active:
+                continue  # Removed after it was queued
+            self.active += 1
+            self._idle.clear()
+            if self.metrics is not None:
+                self.metrics.observe_lag(max(0.0, self.clock() - entry.due))
+            try:
+                result = await entry.job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log("❌ Unexpected error in job for {}: {}", entry.key, e)
+                result = None
+            finally:
+                self.active -= 1
+                if not self.active:
+                    self._idle.set()
+            self._reschedule(entry, result)
+
+    async def run(self, forever=False, drain_timeout=30.0):
+        """Dispatch due jobs until no jobs remain, until drained, or until cancelled if forever is set"""
+        loop = asyncio.get_running_loop()
+        self.draining = False
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            while (self.jobs or forever) and not self.draining:
+                self._wakeup.clear()
+                now = self.clock()
+                while not self.paused and self._heap and self._heap[0][0] <= now:
+                    _, _, entry = heapq.heappop(self._heap)
+                    if entry.active:
+                        self._queue.put_nowait(entry)
+
+                # A timer rather than wait_for(), which can swallow an outer cancel
+                timer = None
+                if self._heap and not self.paused:
+                    timer = loop.call_later(self._heap[0][0] - now, self._wakeup.set)
+                try:
+                    await self._wakeup.wait()
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+
+            if self.draining:
+                # Put back what hasn't started yet, then give in-flight sends time to finish
+                while not self._queue.empty():
+                    self._push(self._queue.get_nowait())
+                idle = asyncio.ensure_future(self._idle.wait())
+                await asyncio.wait([idle], timeout=drain_timeout)
+                idle.cancel()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Sends queued but not started stay due instead of leaking into the next run
+            while not self._queue.empty():
+                entry = self._queue.get_nowait()
+                if entry.active:
+                    self._push(entry)
+
+class RateGovernor:
+    """Account-wide token bucket that every outgoing send passes through
+
+    A flood wait freezes the whole account for the requested time, halves the
+    send rate and lowers the learned ceiling to just below the rate that
+    triggered it. Successful sends ramp the rate back up slowly, and the
+    ceiling is probed upwards again after a long quiet period. When sends
+    have to wait for a token, they get it in priority order (higher first,
+    then first come first served).
+    """
+
+    def __init__(self, rate=1.0, burst=3, min_rate=0.05, max_rate=3.0,
+                 ramp_step=0.01, probe_after=600, clock=time.monotonic):
+        self.clock = clock
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.ceiling = max_rate
+        self.ramp_step = ramp_step
+        self.probe_after = probe_after
+        self.tokens = float(burst)
+        self.frozen_until = 0.0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self._last_refill = clock()
+        self._last_flood = clock()
+        self._recent = deque()  # send timestamps within the last minute
+        self._waiters = []  # (-priority, seq, future)
+        self._seq = itertools.count()
+        self._dispatcher = None
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def observed_rate(self, window=60.0):
+        """Sends per second over the recent window"""
+        now = self.clock()
+        while self._recent and self._recent[0] < now - window:
+            self._recent.popleft()
+        if not self._recent:
+            return 0.0
+        return len(self._recent) / max(1.0, now - self._recent[0])
+
+    def _take(self, now):
+        self.tokens -= 1
+        self._recent.append(now)
+
+    async def acquire(self, priority=0):
+        """Wait until the account may send one more request"""
+        now = self.clock()
+        if not self._waiters and now >= self.frozen_until:
+            self._refill(now)
+            if self.tokens >= 1:
+                self._take(now)
+                return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.tokens += 1  # Granted just as we were cancelled; give it back
+            raise
+
+    async def _dispatch(self):
+        """Hand out tokens to waiting sends, best priority first, until none are left"""
+        while True:
+            while self._waiters and self._waiters[0][2].cancelled():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                return
+            now = self.clock()
+            if now < self.frozen_until:
+                await asyncio.sleep(self.frozen_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self._take(now)
+                heapq.heappop(self._waiters)[2].set_result(None)
+                continue
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        """Ramp the rate back towards the learned ceiling"""
+        now = self.clock()
+        if now - self._last_flood > self.probe_after and self.ceiling < self.max_rate:
+            self.ceiling = min(self.max_rate, self.ceiling * 1.1)
+            self._last_flood = now
+        self.rate = min(self.ceiling, self.rate + self.ramp_step)
+
+    def on_flood_wait(self, seconds):
+        """Freeze every send for the given time and learn a lower safe rate"""
+        now = self.clock()
+        observed = self.observed_rate()
+        if observed > 0:
+            self.ceiling = max(self.min_rate, min(self.ceiling, observed * 0.8))
+        self.rate = max(self.min_rate, min(self.rate, self.ceiling) / 2)
+        self.tokens = 0.0
+        self._last_refill = now + seconds
+        self.frozen_until = max(self.frozen_until, now + seconds)
+        self._last_flood = now
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+
+class EntityIndex:
+    """Persistent local index of peers so chat validation needs no round-trips
+
+    The index is filled in bulk from one sweep over the dialog list and kept
+    on disk. Lookups are local; peers that are still missing are resolved
+    with a bounded number of concurrent get_entity calls.
+    """
+
+    def __init__(self, client, store, concurrency=8, governor=None):
+        self.client = client
+        self.store = store
+        self.governor = governor  # told about flood waits so sends pause as well
+        # marked peer id -> {"type", "id", "access_hash", "forum"}
+        self.peers = store.table("entities")
+        self.swept = False
+        # peer ids the last bulk resolve could not find, so resolve() skips them
+        self.unresolved = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def add(self, entity):
+        """Record a user, chat or channel entity"""
+        if isinstance(entity, types.User):
+            kind = "user"
+        elif isinstance(entity, types.Chat):
+            kind = "chat"
+        elif isinstance(entity, types.Channel):
+            kind = "channel"
+        else:
+            return
+        access_hash = getattr(entity, "access_hash", None)
+        if kind != "chat" and access_hash is None:
+            return  # min entities can't be addressed on their own
+        peer_id = str(utils.get_peer_id(entity))
+        record = {
+            "type": kind,
+            "id": entity.id,
+            "access_hash": access_hash or 0,
+            "forum": bool(getattr(entity, "forum", False)),
+        }
+        if self.peers.get(peer_id) != record:
+            self.store.set("entities", peer_id, record)
+
+    def forget(self, peer_id):
+        """Drop a peer that the server no longer accepts"""
+        self.store.delete("entities", str(peer_id))
+
+    def lookup(self, peer_id):
+        """Return (input_peer, is_forum) from the local index, or None"""
+        record = self.peers.get(str(peer_id))
+        if record is None:
+            return None
+        if record["type"] == "user":
+            peer = types.InputPeerUser(record["id"], record["access_hash"])
+        elif record["type"] == "chat":
+            peer = types.InputPeerChat(record["id"])
+        else:
+            peer = types.InputPeerChannel(record["id"], record["access_hash"])
+        return peer, record["forum"]
+
+    async def _flood_wait(self, error):
+        if self.governor is not None:
+            self.governor.on_flood_wait(error.seconds)
+        await asyncio.sleep(error.seconds)
+
+    async def refresh(self):
+        """Fill the index from a single sweep over all dialogs"""
+        while True:
+            try:
+                async for dialog in self.client.iter_dialogs():
+                    self.add(dialog.entity)
+                break
+            except errors.FloodWaitError as e:
+                await self._flood_wait(e)
+        self.swept = True
+
+    async def _fetch(self, peer_id):
+        async with self._semaphore:
+            while True:
+                try:
+                    self.add(await self.client.get_entity(peer_id))
+                    return
+                except errors.FloodWaitError as e:
+                    await self._flood_wait(e)
+                except Exception:
+                    return
+
+    async def resolve_many(self, peer_ids):
+        """Make sure every given peer id is in the index where possible"""
+        missing = {int(peer_id) for peer_id in peer_ids if str(peer_id) not in self.peers}
+        if missing and not self.swept:
+            await self.refresh()
+            missing = {peer_id for peer_id in missing if str(peer_id) not in self.peers}
+        if missing:
+            await asyncio.gather(*(self._fetch(peer_id) for peer_id in missing))
+        self.unresolved = {str(peer_id) for peer_id in missing if str(peer_id) not in self.peers}
+
+    async def resolve(self, peer_id):
+        """Look up one peer, fetching it from the server on a miss
+
+        Peers that the last resolve_many already failed to fetch are not
+        asked for again.
+        """
+        found = self.lookup(peer_id)
+        if found is None and str(peer_id) not in self.unresolved:
+            await self._fetch(int(peer_id))
+            found = self.lookup(peer_id)
+        return found
+
+class ScheduleState:
+    """Persist next-due and last-success times so a restart resumes the schedule
+
+    Due times are stored as wall-clock timestamps and converted back to the
+    scheduler's monotonic clock on load. Sends only mark their chat as
+    changed; the changed chats are written to the store just before each of
+    its flushes.
+    """
+
+    def __init__(self, store, scheduler):
+        self.store = store
+        self.scheduler = scheduler
+        # chat id -> {"next_due", "last_success"} as wall-clock timestamps
+        self.saved = store.table("schedule") if store is not None else {}
+        self.last_success = {chat_id: state.get("last_success") for chat_id, state in self.saved.items()}
+        self.dirty = set()
+        if store is not None:
+            store.hooks.append(self.sync)
+
+    def record_success(self, chat_id):
+        self.last_success[chat_id] = time.time()
+        self.dirty.add(chat_id)
+
+    def touch(self, chat_id):
+        """Mark a chat whose schedule changed so the next flush records it"""
+        self.dirty.add(chat_id)
+
+    def plan(self, targets, offsets=None, catch_up=60.0):
+        """Pick the first due time for each (chat_id, interval) on the monotonic clock
+
+        Chats with a saved future due time resume it. Chats that became due
+        while we were down are caught up within `catch_up` seconds (or their
+        interval, if shorter). Chats without history start at their
+        configured phase offset if they have one, and are otherwise spread
+        evenly over their interval instead of all firing at once.
+        """
+        offsets = offsets or {}
+        now, wall_now = self.scheduler.clock(), time.time()
+        first_due = {}
+        overdue = []
+        spread = []
+        for chat_id, interval in targets:
+            next_due = self.saved.get(chat_id, {}).get("next_due")
+            if next_due is not None and next_due > wall_now:
+                first_due[chat_id] = now + min(next_due - wall_now, interval)
+            elif next_due is not None:
+                overdue.append((chat_id, interval))
+            elif offsets.get(chat_id) is not None:
+                first_due[chat_id] = now + offsets[chat_id] % interval
+            else:
+                spread.append((chat_id, interval))
+        for i, (chat_id, interval) in enumerate(overdue):
+            first_due[chat_id] = now + min(interval, catch_up) * i / len(overdue)
+        for i, (chat_id, interval) in enumerate(spread):
+            first_due[chat_id] = now + interval * i / len(spread)
+        return first_due
+
+    def sync(self):
+        """Copy the current schedule of every changed chat into the store"""
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        now, wall_now = self.scheduler.clock(), time.time()
+        for chat_id in dirty:
+            entry = self.scheduler.jobs.get(chat_id)
+            if entry is None:
+                self.store.delete("schedule", chat_id)
+            else:
+                self.store.set("schedule", chat_id, {
+                    "next_due": round(wall_now + entry.due - now, 3),
+                    "last_success": self.last_success.get(chat_id),
+                })
+
+class CircuitBreaker:
+    """Failure state of one target"""
+    __slots__ = ("failures", "open_until", "trips")
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.trips = 0
+
+class RetryPolicy:
+    """Classify send errors and decide when a target is tried again
+
+    Permanent errors stop the target, throttling errors wait exactly as long
+    as Telegram asks, and everything else is transient: it is retried with
+    exponential backoff and jitter. After `failure_threshold` transient
+    failures in a row the target's circuit breaker opens and the target is
+    parked for `breaker_cooldown` seconds (doubling on each repeat trip, up
+    to `max_cooldown`) before a single probe send.
+    """
+
+    PERMANENT_ERRORS = LazyErrors(
+        "ChatWriteForbiddenError",
+        "UserBannedInChannelError",
+        "PeerIdInvalidError",
+        "ChannelPrivateError",
+        "ChannelInvalidError",
+        "ChatIdInvalidError",
+        "ChatAdminRequiredError",
+        "ChatRestrictedError",
+        "ChatSendMediaForbiddenError",
+        "UserIsBlockedError",
+        "InputUserDeactivatedError",
+        "TopicDeletedError",
+    )
+    THROTTLING_ERRORS = LazyErrors("FloodWaitError", "SlowModeWaitError")
+
+    def __init__(self, base_delay=2.0, max_delay=600.0, jitter=0.5,
+                 failure_threshold=5, breaker_cooldown=900.0, max_cooldown=6 * 3600.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.failure_threshold = failure_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.max_cooldown = max_cooldown
+
+    def classify(self, error):
+        """Return 'permanent', 'throttling' or 'transient'"""
+        if isinstance(error, self.PERMANENT_ERRORS):
+            return "permanent"
+        if isinstance(error, self.THROTTLING_ERRORS):
+            return "throttling"
+        return "transient"
+
+    def backoff(self, attempt):
+        """Delay before retry number `attempt`, with jitter"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(1 - self.jitter, 1)
+
+    def on_failure(self, breaker, now):
+        """Record a transient failure; return (delay, breaker_opened)"""
+        breaker.failures += 1
+        if breaker.failures < self.failure_threshold:
+            return self.backoff(breaker.failures), False
+        cooldown = min(self.max_cooldown, self.breaker_cooldown * 2 ** breaker.trips)
+        breaker.trips += 1
+        # Half-open: one probe after the cooldown; a failed probe trips it again
+        breaker.failures = self.failure_threshold - 1
+        breaker.open_until = now + cooldown
+        return cooldown, True
+
+class ConnectionManager:
+    """Own the client's connection lifecycle and cache its authorization state
+
+    `ready` is set while the link is up; the send path waits on it, so a
+    reconnect pauses every send instead of letting them all fail at once.
+    Only one reconnect runs at a time and it backs off exponentially.
+    """
+
+    def __init__(self, client, log=None, metrics=None, keepalive_seconds=60, max_backoff=300):
+        self.client = client
+        self.log = log or StatusLog()
+        self.metrics = metrics
+        self.keepalive_seconds = keepalive_seconds
+        self.max_backoff = max_backoff
+        self.authorized = None
+        self.ready = asyncio.Event()
+        self._reconnecting = None
+
+    async def ensure_connected(self):
+        """Connect if needed; cheap when already connected"""
+        if not self.client.is_connected():
+            await self.client.connect()
+        self.ready.set()
+
+    async def is_authorized(self, refresh=False):
+        """Return the cached authorization state, asking the server only once"""
+        await self.ensure_connected()
+        if self.authorized is None or refresh:
+            self.authorized = await self.client.is_user_authorized()
+        return self.authorized
+
+    def reconnect_soon(self):
+        """Start a reconnect unless one is already running, and pause sending"""
+        if self._reconnecting is None or self._reconnecting.done():
+            self.ready.clear()
+            self._reconnecting = asyncio.create_task(self._reconnect())
+        return self._reconnecting
+
+    async def _reconnect(self):
+        delay = 1.0
+        while True:
+            try:
+                await self.client.disconnect()
+                await self.client.connect()
+                self.ready.set()
+                if self.metrics is not None:
+                    self.metrics.inc("reconnects_total")
+                self.log("🔌 Reconnected to Telegram.")
+                return
+            except Exception as e:
+                wait = delay + random.uniform(0, delay / 2)
+                self.log("⚠️ Reconnect failed: {}. Retrying in {:.0f}s...", e, wait)
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, self.max_backoff)
+
+    async def wait_ready(self):
+        if not self.ready.is_set():
+            await self.ready.wait()
+
+    async def keepalive(self):
+        """Ping the server periodically and reconnect when the link is gone"""
+        while True:
+            await asyncio.sleep(self.keepalive_seconds)
+            if not self.ready.is_set():
+                continue
+            try:
+                if not self.client.is_connected():
+                    raise ConnectionError("client disconnected")
+                # A real round-trip; get_me(input_peer=True) answers from the cache
+                await self.client(help_requests.GetNearestDcRequest())
+            except (ConnectionError, OSError, asyncio.TimeoutError):
+                await self.reconnect_soon()
+            except Exception as e:
+                # An RPC error still means the link is up; keep pinging
+                self.log("⚠️ Keepalive ping failed: {}", e)
+
+class Dashboard:
+    """Full-screen status view redrawn at a fixed frame rate from in-memory counters"""
+
+    def __init__(self, forwarder, fps=2.0, log_lines=8, stream=None):
+        self.forwarder = forwarder
+        self.fps = fps
+        self.stream = stream or sys.stdout
+        self.tail = deque(maxlen=log_lines)
+        self._last = (time.monotonic(), 0)
+
+    def render(self):
+        forwarder = self.forwarder
+        scheduler, governor, pipeline = forwarder.scheduler, forwarder.governor, forwarder.pipeline
+        counters = forwarder.metrics.counters
+        snapshot = forwarder.metrics.snapshot()
+        now = time.monotonic()
+
+        sends = counters.get("sends_total", 0)
+        last_time, last_sends = self._last
+        per_second = (sends - last_sends) / max(now - last_time, 1e-6)
+        self._last = (now, sends)
+
+        state = "draining" if scheduler.draining else "paused" if scheduler.paused else "running"
+        next_due = scheduler.next_due()
+        next_send = format_interval(max(0, int(next_due - now))) if next_due is not None else "-"
+        frozen = governor.frozen_until - now
+        lag = snapshot["avg_scheduler_lag"]
+        lines = [
+            f"📡 TEL-AU  {time.strftime('%H:%M:%S')}  [{state}]",
+            f"💬 Chats: {len(scheduler.jobs)} scheduled, {forwarder.parked_chats()} parked   "
+            f"⏳ Next send in {next_send}",
+            f"🚀 Sends: {sends} ({per_second:.1f}/s)   ❌ Errors: {counters.get('errors_total', 0)}   "
+            f"⚠️ Flood waits: {governor.flood_waits} ({governor.flood_wait_seconds}s)",
+            f"🚦 Rate: {governor.rate:.2f}/s of {governor.ceiling:.2f}/s"
+            + (f"   🧊 frozen {frozen:.0f}s" if frozen > 0 else ""),
+            f"📤 In flight: {pipeline.in_flight['text']} text, {pipeline.in_flight['media']} media   "
+            f"Queued: {pipeline.queued()}   Scheduler lag: {lag * 1000 if lag else 0:.0f} ms",
+            f"🖼️ Uploads: {counters.get('uploads_total', 0)} "
+            f"({counters.get('upload_bytes_total', 0) / 1024:.0f} KB)",
+            "",
+            *self.tail,
+            "",
+        ]
+        if forwarder.control_path:
+            lines.append(f"🎛️ Control: python telau.py ctl status|pause|resume|add|remove|drain")
+        lines.append("Press Ctrl+C to stop gracefully")
+        return "\n".join(lines)
+
+    async def run(self):
+        """Redraw until cancelled"""
+        self.forwarder.log.tail = self.tail
+        try:
+            while True:
+                # Clear the screen and redraw in a single write
+                self.stream.write("\x1b[H\x1b[2J" + self.render() + "\n")
+                self.stream.flush()
+                await asyncio.sleep(1 / self.fps)
+        finally:
+            self.forwarder.log.tail = None
+            self.stream.write(self.render() + "\n")
+
+class Controller:
+    """Local Unix-socket control channel for a running schedule
+
+    One command per line; the reply is a single line starting with "ok" or
+    "error", except `status`, which replies with a JSON object.
+    """
+
+    COMMANDS = "status | pause | resume | add CHAT_ID INTERVAL [TEXT] | remove CHAT_ID | drain"
+
+    def __init__(self, forwarder, path):
+        self.forwarder = forwarder
+        self.path = path
+
+    async def handle_command(self, line):
+        forwarder = self.forwarder
+        command, _, rest = line.strip().partition(" ")
+        command = command.lower()
+        if command == "status":
+            status = forwarder.metrics.snapshot()
+            status["paused"] = forwarder.scheduler.paused
+            status["chats"] = sorted(forwarder.scheduler.jobs)
+            return json.dumps(status)
+        if command == "pause":
+            forwarder.scheduler.pause()
+            forwarder.log("⏸️ Sending paused.")
+            return "ok paused"
+        if command == "resume":
+            forwarder.scheduler.resume()
+            forwarder.log("▶️ Sending resumed.")
+            return "ok resumed"
+        if command == "drain":
+            forwarder.scheduler.drain()
+            forwarder.log("🛑 Draining: finishing in-flight sends...")
+            return "ok draining"
+        if command == "remove":
+            if not rest or not forwarder.remove_chat(rest):
+                return f"error no such chat {rest!r}"
+            forwarder.log("➖ Removed chat {}", rest.strip())
+            return f"ok removed {rest.strip()}"
+        if command == "add":
+            parts = rest.split(" ", 2)
+            if len(parts) < 2:
+                return "error usage: add CHAT_ID INTERVAL [TEXT]"
+            try:
+                interval = parse_interval(parts[1])
+            except ValueError as e:
+                return f"error {e}"
+            text, image_path = forwarder.default_message
+            if len(parts) == 3:
+                text, image_path = parts[2], None
+            if not text:
+                return "error no default message; give the text to send"
+            chat_id = parts[0]
+            first_due = forwarder.schedule_state.plan([(chat_id, interval)])[chat_id]
+            if not await forwarder.add_chat(chat_id, text, image_path, interval, first_due):
+                return f"error chat {chat_id} is invalid or not accessible"
+            return f"ok added {chat_id}"
+        return f"error unknown command; expected {self.COMMANDS}"
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.handle_command(line.decode("utf-8", "replace"))
+                writer.write(reply.encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Listen on the socket until cancelled"""
+        if os.path.exists(self.path):
+            os.remove(self.path)  # Left over from a run that didn't shut down cleanly
+        server = await asyncio.start_unix_server(self._client, self.path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+async def send_control_command(path, command):
+    """Send one command to a running instance and return its reply"""
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(command.encode() + b"\n")
+    await writer.drain()
+    reply = await reader.readline()
+    writer.close()
+    return reply.decode().strip()
+
+class VirtualClock:
+    """Settable clock for running the scheduler without waiting"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class ScheduleSimulator:
+    """Replay a schedule on a virtual clock and profile its load
+
+    First due times come from the same planning as a real run; after that
+    SendScheduler fires each chat at a fixed rate. Chats sharing a
+    whole-second interval therefore repeat one phase pattern, which is
+    counted once and tiled over the duration, so the cost grows with the
+    number of distinct intervals rather than the number of sends. Intervals
+    shared by only a few chats are filled send by send, where that is cheaper.
+    """
+
+    def __init__(self, targets, max_per_second=3, max_per_minute=60):
+        self.targets = targets  # chat id -> interval in seconds
+        self.max_per_second = max_per_second
+        self.max_per_minute = max_per_minute
+
+    def run(self, duration, offsets=None):
+        """Count sends per second of virtual time over `duration` seconds"""
+        scheduler = SendScheduler(clock=VirtualClock())
+        first_due = ScheduleState(None, scheduler).plan(self.targets.items(), offsets)
+
+        whole = int(duration)
+        per_second = array("I", bytes(4 * (whole + 1)))
+
+        def stride(first, interval):
+            count = -int((first - duration) // interval)  # sends due before the end
+            for k in range(count):
+                per_second[int(first + k * interval)] += 1
+
+        groups = {}  # whole-second interval -> first due times within it
+        for chat_id, interval in self.targets.items():
+            first = first_due[chat_id]
+            if first >= duration:
+                continue
+            if interval == int(interval) and 0 <= first < interval:
+                groups.setdefault(int(interval), []).append(first)
+            else:
+                stride(first, interval)
+
+        # Each group's pattern is added to the counts as one big integer with a
+        # 32-bit field per second, so tiling a week costs a few milliseconds
+        tiled = 0
+        for interval, firsts in groups.items():
+            if len(firsts) * 25 < interval:
+                # Fewer sends than one tile costs (about 25 per second tiled)
+                for first in firsts:
+                    stride(first, interval)
+                continue
+            phase = array("I", bytes(4 * interval))
+            for first in firsts:
+                phase[int(first)] += 1
+                if (whole - int(first)) % interval == 0 and whole + first % 1 < duration:
+                    per_second[whole] += 1  # the partial second at the end
+            pattern = (phase * (whole // interval + 1))[:whole]
+            tiled += int.from_bytes(pattern.tobytes(), sys.byteorder)
+        if tiled:
+            tiled += int.from_bytes(per_second.tobytes(), sys.byteorder)
+            per_second = array("I", tiled.to_bytes(4 * (whole + 1), sys.byteorder))
+        return per_second
+
+    def profile(self, per_second, worst=5):
+        """Summarise a per-second load series against the rate budget"""
+        per_minute = [sum(per_second[i:i + 60]) for i in range(0, len(per_second), 60)]
+        peak_second = max(range(len(per_second)), key=per_second.__getitem__)
+        peak_minute = max(range(len(per_minute)), key=per_minute.__getitem__)
+        over_minutes = sorted(
+            (minute for minute, count in enumerate(per_minute) if count > self.max_per_minute),
+            key=lambda minute: -per_minute[minute],
+        )
+        return {
+            "sends": sum(per_second),
+            "avg_per_second": round(sum(per_second) / len(per_second), 3),
+            "peak_per_second": per_second[peak_second],
+            "peak_second_at": format_offset(peak_second),
+            "peak_per_minute": per_minute[peak_minute],
+            "peak_minute_at": format_offset(peak_minute * 60),
+            "collisions": sum(count - 1 for count in per_second if count > 1),
+            "seconds_over_budget": sum(1 for count in per_second if count > self.max_per_second),
+            "minutes_over_budget": len(over_minutes),
+            "worst_minutes": [(format_offset(minute * 60), per_minute[minute]) for minute in over_minutes[:worst]],
+        }
+
+    # Irrational group shifts keep interval groups out of step; the golden ratio first
+    GROUP_SHIFTS = (0.6180339887, 0.4142135624, 0.7320508076, 0.2360679775)
+
+    def suggest_offsets(self, group_shift=GROUP_SHIFTS[0]):
+        """Phase offsets that space each interval group evenly and interleave the groups"""
+        groups = {}
+        for chat_id, interval in self.targets.items():
+            groups.setdefault(interval, []).append(chat_id)
+        offsets = {}
+        for g, (interval, chat_ids) in enumerate(sorted(groups.items())):
+            shift = (g * group_shift) % 1
+            for i, chat_id in enumerate(chat_ids):
+                offsets[chat_id] = round((i + shift) / len(chat_ids) * interval, 3)
+        return offsets
+
+    @staticmethod
+    def lowers_peak(profile, baseline):
+        """True if neither peak is higher than the baseline's and at least one is lower"""
+        peaks = (profile["peak_per_minute"], profile["peak_per_second"])
+        base = (baseline["peak_per_minute"], baseline["peak_per_second"])
+        return peaks != base and all(a <= b for a, b in zip(peaks, base))
+
+    def improve(self, duration, baseline):
+        """Best suggested offsets and their profile, or (None, None) if none lowers the peak"""
+        best_offsets, best = None, baseline
+        for group_shift in self.GROUP_SHIFTS:
+            offsets = self.suggest_offsets(group_shift)
+            profile = self.profile(self.run(duration, offsets))
+            if self.lowers_peak(profile, best):
+                best_offsets, best = offsets, profile
+        return (best_offsets, best) if best_offsets is not None else (None, None)
 
 class TelegramForwarder:
-    def __init__(self, api_id, api_hash, phone_number):
+    def __init__(self, api_id, api_hash, phone_number, client=None):
         self.api_id = api_id
         self.api_hash = api_hash
         self.phone_number = phone_number
-        self.client = TelegramClient('session_' + phone_number, api_id, api_hash)
+        # A ready-made client can be passed in, e.g. a stand-in for benchmarks
+        # flood_sleep_threshold=0: Telethon must not wait out flood waits inside a
+        # send, so every one reaches the governor and pauses the whole account
+        self.client = client or telethon_sync.TelegramClient(
+            'session_' + phone_number, api_id, api_hash, flood_sleep_threshold=0
+        )
+        if client is None:
+            self.tune_session_file()
+        self.metrics = Metrics()
+        self.log = StatusLog()
+        self.connection = ConnectionManager(self.client, self.log, self.metrics)
+        self.store = StateStore(f"state_{phone_number}.log")
+        self.media_cache = MediaCache(self.client, self.store, self.metrics)
+        self.scheduler = SendScheduler(metrics=self.metrics, log=self.log)
+        self.pipeline = SendPipeline()
+        self.metrics.gauges["in_flight_text"] = lambda: self.pipeline.in_flight["text"]
+        self.metrics.gauges["in_flight_media"] = lambda: self.pipeline.in_flight["media"]
+        self.metrics.gauges["queued_sends"] = self.pipeline.queued
+        self.retry_policy = RetryPolicy()
+        self.breakers = {}  # chat id -> CircuitBreaker, only for chats that have failed
+        self.metrics.gauges["parked_chats"] = self.parked_chats
+        self.schedule_state = ScheduleState(self.store, self.scheduler)
+        self.metrics_port = None
+        self.metrics_jsonl = None
+        self.show_dashboard = False
+        self.control_path = f"control_{phone_number}.sock" if hasattr(socket, "AF_UNIX") else None
+        self.default_message = (None, None)  # used by the control channel's "add"
+        self.message_files = {}  # path -> latest MessageTemplate loaded from it
+        self.session_state_path = f"session_state_{phone_number}.json"
+        self._run_task = None
+        self._force_stop = False  # set by a second Ctrl+C, which cancels the run
+        self.governor = RateGovernor()
+        self.entity_index = EntityIndex(self.client, self.store, governor=self.governor)
+
+    def tune_session_file(self):
+        """Best effort: switch Telethon's SQLite session to WAL so its frequent commits don't wait on fsync
+
+        This is a hack on SQLiteSession's private `_cursor`, checked against
+        Telethon 1.x only. On any other version or session type the session
+        file is left as Telethon made it.
+        """
+        telethon = importlib.import_module("telethon")
+        session = self.client.session
+        if not telethon.__version__.startswith("1.") \
+                or not isinstance(session, importlib.import_module("telethon.sessions").SQLiteSession) \
+                or session.filename == ":memory:" or not hasattr(session, "_cursor"):
+            return
+        try:
+            cursor = session._cursor()
+            cursor.execute("pragma journal_mode=wal")
+            cursor.execute("pragma synchronous=normal")
+            cursor.close()
+        except Exception as e:
+            print(f"⚠️ Could not tune session file {session.filename}: {e}")
 
     async def login(self):
         """Handle login process and save session"""
         print("🔐 Starting login process...")
-        await self.client.connect()
-
-        if await self.client.is_user_authorized():
+        if await self.connection.is_authorized(refresh=True):
             print("✅ Already logged in!")
             return True
 
@@ -26,188 +1673,844 @@ class TelegramForwarder:
             print(f"📱 Sending verification code to {self.phone_number}...")
             await self.client.send_code_request(self.phone_number)
             
-            code = input('🔑Enter the verification code: ')
-            await self.client.sign_in(self.phone_number, code)
+            code = await ainput('🔑Enter the verification code: ')
+            me = await self.client.sign_in(self.phone_number, code)
             
         except errors.rpcerrorlist.SessionPasswordNeededError:
-            password = input('🔑Two-step verification is enabled. Enter your password: ')
-            await self.client.sign_in(password=password)
+            password = await ainput('🔑Two-step verification is enabled. Enter your password: ')
+            me = await self.client.sign_in(password=password)
         except Exception as e:
             print(f"❌ Login failed: {e}")
             return False
 
+        self.connection.authorized = True
+        self.remember_session(me)
         print("✅ Login successful! Session saved.")
         return True
 
     async def check_session(self):
         """Check if session exists and is valid"""
         try:
-            await self.client.connect()
-            if await self.client.is_user_authorized():
+            if await self.connection.is_authorized(refresh=True):
                 me = await self.client.get_me()
+                self.remember_session(me)
                 print(f"✅ Session is valid. Logged in as: {me.first_name} (@{me.username or 'No username'})")
                 return True
             else:
+                self.remember_session(None)
                 print("❌ Session exists but not authorized.")
                 return False
         except Exception as e:
             print(f"❌ Session check failed: {e}")
             return False
 
-    async def list_chats(self):
-        await self.client.connect()
+    def cached_session(self):
+        """Account seen by the last successful session check, without any network traffic"""
+        if not check_session_file_exists(self.phone_number):
+            return None
+        return load_json(self.session_state_path, {}).get("account")
+
+    def remember_session(self, me):
+        """Record who the session belongs to, or that it is no longer authorized"""
+        if me is None:
+            if os.path.exists(self.session_state_path):
+                os.remove(self.session_state_path)
+            return
+        account = {"first_name": me.first_name, "username": me.username}
+        save_json(self.session_state_path, {"account": account, "checked_at": time.time()})
+
+    async def verify_session(self):
+        """Confirm a cached session with the server: True, False, or None when it can't be reached"""
+        try:
+            authorized = await self.connection.is_authorized(refresh=True)
+            self.remember_session(await self.client.get_me() if authorized else None)
+            return authorized
+        except Exception:
+            return None  # Offline; sending reconnects and finds out
+
+    async def fetch_forum_topics(self, channel, page_size=100):
+        """Fetch every topic of a forum, following pagination to the end"""
+        topics = []
+        offset_date, offset_id, offset_topic = 0, 0, 0
+        while True:
+            result = await self.client(channel_requests.GetForumTopicsRequest(
+                channel=channel,
+                offset_date=offset_date,
+                offset_id=offset_id,
+                offset_topic=offset_topic,
+                limit=page_size
+            ))
+            page = [topic for topic in result.topics if getattr(topic, "title", None) is not None]
+            topics.extend(page)
+            if len(result.topics) < page_size or len(topics) >= result.count:
+                return topics
+
+            last = result.topics[-1]
+            messages = {message.id: message for message in result.messages}
+            offset_topic = last.id
+            offset_id = last.top_message
+            offset_date = getattr(messages.get(last.top_message), "date", None) or 0
 
+    async def _dialog_record(self, dialog, previous, semaphore):
+        """Build the export record of one dialog, reusing the previous snapshot if unchanged"""
+        top_message = dialog.message.id if dialog.message else 0
+        record = {
+            "id": dialog.id,
+            "title": dialog.title,
+            "forum": isinstance(dialog.entity, types.Channel) and bool(getattr(dialog.entity, 'forum', False)),
+            "top_message": top_message,
+            "topics": [],
+        }
+        if previous is not None and previous.get("top_message") == top_message \
+                and previous.get("title") == dialog.title:
+            record["topics"] = previous.get("topics", [])
+            return record, False
+
+        if record["forum"]:
+            async with semaphore:
+                try:
+                    topics = await self.fetch_forum_topics(dialog.entity)
+                    record["topics"] = [{"id": topic.id, "title": topic.title} for topic in topics]
+                except Exception as e:
+                    print(f"⚠️ Error fetching topics for {dialog.title}: {e}")
+        return record, True
+
+    async def list_chats(self, incremental=False, concurrency=8, window=64):
+        """Stream every dialog and its forum topics to the text and JSONL exports
+
+        Topics of up to `concurrency` forums are fetched at once while the
+        output keeps dialog order. With `incremental`, dialogs whose last
+        message and title match the previous JSONL snapshot are copied from
+        it instead of being fetched again.
+        """
+        # Nothing is sent while listing, so let Telethon wait out short flood waits in place
+        threshold = self.client.flood_sleep_threshold
+        self.client.flood_sleep_threshold = 60
+        try:
+            await self._list_chats(incremental, concurrency, window)
+        finally:
+            self.client.flood_sleep_threshold = threshold
+
+    async def _list_chats(self, incremental, concurrency, window):
         # Session should already be validated before calling this
-        if not await self.client.is_user_authorized():
+        if not await self.connection.is_authorized():
             print("❌ Not authorized. Please login first.")
             return
 
-        dialogs = await self.client.get_dialogs(limit=None)
-        with open(f"chats_of_{self.phone_number}.txt", "w", encoding="utf-8") as chats_file:
-            for dialog in dialogs:
-                chats_file.write(f"💬 MAIN CHAT ID: {dialog.id}, Title: {dialog.title}\n")
-                print(f"💬 MAIN CHAT ID: {dialog.id}, Title: {dialog.title}")
+        txt_path = f"chats_of_{self.phone_number}.txt"
+        jsonl_path = f"chats_of_{self.phone_number}.jsonl"
+        snapshot = {}
+        if incremental:
+            snapshot = load_jsonl(jsonl_path, key="id")
 
-                if isinstance(dialog.entity, Channel) and getattr(dialog.entity, 'forum', False):
-                    try:
-                        topics = await self.client(GetForumTopicsRequest(
-                            channel=dialog.entity,
-                            offset_date=0,
-                            offset_id=0,
-                            offset_topic=0,
-                            limit=100
-                        ))
-                        for topic in topics.topics:
-                            chats_file.write(f"    🗂️ TOPIC ID: {dialog.id}/{topic.id}, Title: {topic.title}\n")
-                            print(f"    🗂️ TOPIC ID: {dialog.id}/{topic.id}, Title: {topic.title}")
-                    except Exception as e:
-                        print(f"⚠️ Error fetching topics for {dialog.title}: {e}")
+        semaphore = asyncio.Semaphore(concurrency)
+        pending = deque()
+        total = changed = 0
+
+        with open(txt_path + ".tmp", "w", encoding="utf-8") as chats_file, \
+                open(jsonl_path + ".tmp", "w", encoding="utf-8") as jsonl_file:
 
+            async def write_next():
+                nonlocal total, changed
+                record, is_changed = await pending.popleft()
+                total += 1
+                changed += is_changed
+                jsonl_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                lines = [f"💬 MAIN CHAT ID: {record['id']}, Title: {record['title']}"]
+                lines += [f"    🗂️ TOPIC ID: {record['id']}/{topic['id']}, Title: {topic['title']}"
+                          for topic in record["topics"]]
+                chats_file.write("\n".join(lines) + "\n")
+                if is_changed or not incremental:
+                    print("\n".join(lines))
+
+            try:
+                async for dialog in self.client.iter_dialogs():
+                    self.entity_index.add(dialog.entity)
+                    pending.append(asyncio.ensure_future(
+                        self._dialog_record(dialog, snapshot.get(dialog.id), semaphore)
+                    ))
+                    if len(pending) >= window:
+                        await write_next()
+                while pending:
+                    await write_next()
+            except BaseException:
+                for task in pending:
+                    task.cancel()
+                raise
+
+        os.replace(txt_path + ".tmp", txt_path)
+        os.replace(jsonl_path + ".tmp", jsonl_path)
+        self.entity_index.swept = True
+        self.store.save()
+        if incremental:
+            print(f"🔄 {changed} of {total} chat(s) changed since the last listing.")
         print("✅List of groups and topics printed successfully!")
 
+    @staticmethod
+    def parse_chat_id(chat_id):
+        """Split a chat ID string into (peer_id, topic_id), raising ValueError on bad input"""
+        chat_id = chat_id.strip()
+        if "/" in chat_id:
+            group_id, topic_id = chat_id.split("/")
+            return int(group_id), int(topic_id)
+        return int(chat_id), None
+
     async def validate_chat_id(self, chat_id):
         """Validate if chat ID is accessible"""
         try:
-            chat_id = chat_id.strip()
-            if "/" in chat_id:
-                group_id, topic_id = chat_id.split("/")
-                entity = await self.client.get_entity(int(group_id))
-                # Check if it's a valid forum topic
-                if hasattr(entity, 'forum') and entity.forum:
-                    return True, entity, int(topic_id)
-                else:
-                    return False, None, None
-            else:
-                entity = await self.client.get_entity(int(chat_id))
-                return True, entity, None
+            peer_id, topic_id = self.parse_chat_id(chat_id)
+            found = await self.entity_index.resolve(peer_id)
+            if found is None:
+                return False, None, None
+            entity, is_forum = found
+            if topic_id is not None and not is_forum:
+                # Topic IDs are only valid in forum groups
+                return False, None, None
+            return True, entity, topic_id
         except Exception as e:
             return False, None, None
 
-    async def send_to_single_chat(self, chat_id, text, image_path, interval_seconds):
-        """Send messages to a single chat with its specific interval"""
-        # First validate the chat ID
+    async def validate_chat_ids(self, chat_ids):
+        """Resolve every chat ID in bulk so per-chat validation is a local lookup"""
+        peer_ids = []
+        for chat_id in chat_ids:
+            try:
+                peer_ids.append(self.parse_chat_id(chat_id)[0])
+            except ValueError:
+                pass
+        await self.entity_index.resolve_many(peer_ids)
+
+    async def send_to_single_chat(self, plan):
+        """Send one message for a compiled plan and report how to reschedule it"""
+        chat_id = plan.chat_id
+        try:
+            await self.connection.wait_ready()
+            # Take the rate token before a pipeline slot, so sends waiting on the
+            # governor don't hold slots that higher-priority sends need
+            await self.governor.acquire(plan.priority)
+            await self.pipeline.acquire(plan.lane, plan.priority)
+            try:
+                if self.scheduler.draining:
+                    return 0  # Not sent yet; stays due for the next run
+                started = time.monotonic()
+                if plan.media:
+                    await self.media_cache.send_file(
+                        plan.media, entity=plan.entity, caption=plan.text, reply_to=plan.topic_id
+                    )
+                    self.log.routine("🚀Sent message with image to {}", chat_id)
+                else:
+                    await self.client.send_message(plan.entity, plan.text, reply_to=plan.topic_id)
+                    self.log.routine("🚀Sent message to {}", chat_id)
+            finally:
+                self.pipeline.release(plan.lane)
+            self.metrics.observe_send(chat_id, time.monotonic() - started)
+            self.schedule_state.record_success(chat_id)
+            self.governor.on_success()
+
+        except Exception as e:
+            self.schedule_state.touch(chat_id)
+            return self.handle_send_error(chat_id, plan.entity, e)
+
+        if self.breakers:
+            breaker = self.breakers.pop(chat_id, None)
+            if breaker is not None and breaker.trips:
+                self.log("✅ Chat {} recovered, back on its normal schedule.", chat_id)
+
+        self.log.routine("⏳ Chat {}: Waiting {} before next send...", chat_id, plan.interval_label)
+        return None
+
+    def handle_send_error(self, chat_id, entity, error):
+        """Apply the retry policy to a failed send and return the scheduler's next step"""
+        self.metrics.observe_error(error)
+        kind = self.retry_policy.classify(error)
+
+        if kind == "throttling":
+            if isinstance(error, errors.FloodWaitError):
+                self.log("⚠️ Rate limit hit for {}. Pausing all chats for {} seconds...", chat_id, error.seconds)
+                self.metrics.inc("flood_wait_seconds_total", error.seconds)
+                self.governor.on_flood_wait(error.seconds)
+            else:
+                self.log("⚠️ Slow mode in {}. Waiting {} seconds...", chat_id, error.seconds)
+            return error.seconds
+
+        if kind == "permanent":
+            if isinstance(error, errors.ChatWriteForbiddenError):
+                self.log("❌ No permission to write in chat {}. Stopping this chat.", chat_id)
+            elif isinstance(error, errors.UserBannedInChannelError):
+                self.log("❌ You are banned in chat {}. Stopping this chat.", chat_id)
+            elif isinstance(error, errors.PeerIdInvalidError):
+                self.log("❌ Invalid peer ID {}. Stopping this chat.", chat_id)
+                self.entity_index.forget(utils.get_peer_id(entity))
+            else:
+                self.log("❌ Cannot send to {} ({}). Stopping this chat.", chat_id, error)
+            self.breakers.pop(chat_id, None)
+            return False
+
+        if isinstance(error, ConnectionError):
+            self.log("🔌 Connection lost while sending to {}: {}", chat_id, error)
+            self.connection.reconnect_soon()
+            return 1  # Sending resumes once the connection is back; not the chat's fault
+
+        breaker = self.breakers.get(chat_id)
+        if breaker is None:
+            breaker = self.breakers[chat_id] = CircuitBreaker()
+        delay, opened = self.retry_policy.on_failure(breaker, time.monotonic())
+        self.metrics.inc("retries_total")
+        if opened:
+            self.metrics.inc("breaker_trips_total")
+            self.log("🚧 Chat {} keeps failing ({}). Parking it for {}.", chat_id, error, format_interval(int(delay)))
+        else:
+            self.log("❌ Error sending to {}: {}. Retrying in {:.0f}s...", chat_id, error, delay)
+        return delay
+
+    def parked_chats(self):
+        """Number of chats whose circuit breaker is currently open"""
+        now = time.monotonic()
+        return sum(1 for breaker in self.breakers.values() if breaker.open_until > now)
+
+    async def add_chat(self, chat_id, text, image_path, interval_seconds, first_due=None, priority=0,
+                       variables=None):
+        """Validate a chat and add it to the running schedule
+
+        `text` is a plain string or a MessageTemplate filled in with `variables`.
+        """
+        chat_id = chat_id.strip()
         is_valid, entity, topic_id = await self.validate_chat_id(chat_id)
         
         if not is_valid:
-            print(f"❌ Chat ID {chat_id} is invalid or not accessible. Skipping this chat.")
-            print(f"   Common causes:")
-            print(f"   - Chat ID doesn't exist")
-            print(f"   - You're not a member of the group")
-            print(f"   - Bot restrictions (if applicable)")
-            print(f"   - Wrong ID format")
-            return
-        
-        print(f"✅ Chat {chat_id} validated successfully. Starting periodic sending...")
+            self.log(
+                "❌ Chat ID {} is invalid or not accessible. Skipping this chat.\n"
+                "   Common causes:\n"
+                "   - Chat ID doesn't exist\n"
+                "   - You're not a member of the group\n"
+                "   - Bot restrictions (if applicable)\n"
+                "   - Wrong ID format", chat_id
+            )
+            return False
         
-        while True:
-            try:
-                chat_id = chat_id.strip()
-                if topic_id is not None:  # Forum topic
-                    send_params = {
-                        "entity": entity,
-                        "message": text,
-                        "reply_to": topic_id
-                    }
-                else:  # Regular chat
-                    send_params = {"entity": entity, "message": text}
-
-                if image_path:
-                    await self.client.send_file(**send_params, file=image_path, caption=text)
-                    print(f"🚀Sent message with image to {chat_id}")
-                else:
-                    await self.client.send_message(**send_params)
-                    print(f"🚀Sent message to {chat_id}")
+        self.log("✅ Chat {} validated successfully. Starting periodic sending...", chat_id)
+        if first_due is not None and first_due > self.scheduler.clock() + 1:
+            self.log("🗓️ Chat {}: first send in {}", chat_id, format_interval(int(first_due - self.scheduler.clock())))
 
-            except errors.FloodWaitError as e:
-                print(f"⚠️ Rate limit hit for {chat_id}. Waiting {e.seconds} seconds...")
-                await asyncio.sleep(e.seconds)
+        template = text if isinstance(text, MessageTemplate) else MessageTemplate.plain(text)
+        if template.path is not None:
+            self.message_files.setdefault(template.path, template)
+        plan = SendPlan(
+            chat_id, entity, topic_id, template, variables, image_path, interval_seconds, priority,
+            self.send_to_single_chat
+        )
+        self.scheduler.add(chat_id, interval_seconds, plan, first_due)
+        self.schedule_state.touch(chat_id)
+        return True
+
+    def remove_chat(self, chat_id):
+        """Stop sending to a chat without touching the others"""
+        chat_id = chat_id.strip()
+        self.schedule_state.touch(chat_id)
+        return self.scheduler.remove(chat_id)
+
+    def switch_template(self, template):
+        """Move the chats sending a message file onto its new template"""
+        switched = kept = 0
+        for entry in self.scheduler.jobs.values():
+            plan = entry.job
+            if plan.template.path != template.path or plan.template is template:
                 continue
-            except errors.ChatWriteForbiddenError:
-                print(f"❌ No permission to write in chat {chat_id}. Stopping this chat.")
-                break
-            except errors.UserBannedInChannelError:
-                print(f"❌ You are banned in chat {chat_id}. Stopping this chat.")
-                break
-            except errors.PeerIdInvalidError:
-                print(f"❌ Invalid peer ID {chat_id}. Stopping this chat.")
-                break
-            except Exception as e:
-                print(f"❌ Error sending to {chat_id}: {str(e)}")
-                # Continue trying for other types of errors
-                await asyncio.sleep(10)  # Wait 10 seconds before retry
-
-            # Convert seconds to readable format for display
-            hours = interval_seconds // 3600
-            minutes = (interval_seconds % 3600) // 60
-            seconds = interval_seconds % 60
-            
-            if hours > 0:
-                time_str = f"{hours}h {minutes}m {seconds}s"
-            elif minutes > 0:
-                time_str = f"{minutes}m {seconds}s"
-            else:
-                time_str = f"{seconds}s"
-                
-            current_time = time.strftime("%H:%M:%S")
-            print(f"⏳[{current_time}] Chat {chat_id}: Waiting {time_str} before next send...")
-            await asyncio.sleep(interval_seconds)
+            if template.missing(plan.variables or {}):
+                kept += 1
+                continue
+            plan.template = template
+            plan.text = template.render(plan.chat_id, plan.variables)
+            switched += 1
+        return switched, kept
+
+    async def watch_message_files(self, poll_seconds=2):
+        """Pick up edits to message files without restarting any schedule"""
+        while True:
+            await asyncio.sleep(poll_seconds)
+            for path, template in list(self.message_files.items()):
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                if mtime_ns == template.mtime_ns:
+                    continue
+                new_template = MessageTemplate.load(path, template.verbatim)
+                if new_template is None:
+                    template.mtime_ns = mtime_ns  # Don't report the same broken file every poll
+                    self.log("⚠️ Message file {} could not be loaded; keeping the previous text.", path)
+                    continue
+                self.message_files[path] = new_template
+                if new_template == template:
+                    continue
+                switched, kept = self.switch_template(new_template)
+                self.log("📝 Message file {} changed: {} chat(s) updated.", path, switched)
+                if kept:
+                    self.log("⚠️ {} chat(s) lack variables the new text uses and keep the previous text.", kept)
 
     async def send_message_periodically_multi_interval(self, chat_configs, text, image_path=None):
         """Send messages to multiple chats with different intervals for each"""
-        await self.client.connect()
-
         # Session should already be validated before calling this
-        if not await self.client.is_user_authorized():
+        if not await self.connection.is_authorized():
             print("❌ Not authorized. Please login first.")
             return
 
-        # Create tasks for each chat with their specific intervals
-        tasks = []
+        if image_path and not await self.prepare_media([image_path]):
+            return
+
+        if not isinstance(text, MessageTemplate):
+            text = MessageTemplate.plain(text)
+        print(f"🔎 Resolving {len(chat_configs)} chat(s)...")
+        self.log.start()
+        await self.validate_chat_ids(chat_configs)
+        first_due = self.schedule_state.plan(
+            (chat_id.strip(), interval_seconds) for chat_id, interval_seconds in chat_configs.items()
+        )
         for chat_id, interval_seconds in chat_configs.items():
-            task = asyncio.create_task(
-                self.send_to_single_chat(chat_id, text, image_path, interval_seconds)
-            )
-            tasks.append(task)
+            await self.add_chat(chat_id, text, image_path, interval_seconds, first_due[chat_id.strip()])
 
-        # Run all tasks concurrently
+        self.default_message = (text, image_path)
+
+        # One scheduler drives every chat
         try:
-            await asyncio.gather(*tasks)
+            await self.run_schedule()
         except KeyboardInterrupt:
             print("\n🛑 Stopping all sending tasks...")
-            for task in tasks:
-                task.cancel()
+        finally:
+            self.scheduler.clear()
+            self.breakers.clear()
+        print("⏹️ Sending stopped.")
+
+    async def prepare_media(self, media_list):
+        """Validate and pre-upload every file before any chat is contacted"""
+        paths = [path for media in media_list if media
+                 for path in ([media] if isinstance(media, str) else media)]
+        if not paths:
+            return True
+        print(f"📤 Preparing {len(set(paths))} media file(s)...")
+        if not await self.media_cache.prepare(paths):
+            print("❌ Media could not be prepared. No chat was contacted.")
+            return False
+        return True
+
+    def stop_gracefully(self):
+        """First Ctrl+C drains in-flight sends; a second one stops immediately"""
+        if self.scheduler.draining and self._run_task is not None:
+            self._force_stop = True
+            self._run_task.cancel()
+            return
+        self.log("🛑 Stopping: finishing in-flight sends (Ctrl+C again to stop now)...")
+        self.scheduler.drain()
+
+    async def run_schedule(self, forever=False):
+        """Run the scheduler together with status output, exporters and controls"""
+        self.log.start()
+        services = [
+            asyncio.create_task(self.store.run()),
+            asyncio.create_task(self.connection.keepalive()),
+            asyncio.create_task(self.watch_message_files()),
+        ]
+        if self.metrics_port:
+            services.append(asyncio.create_task(self.metrics.serve(self.metrics_port)))
+            self.log("📊 Metrics at http://127.0.0.1:{}/metrics", self.metrics_port)
+        if self.metrics_jsonl:
+            services.append(asyncio.create_task(self.metrics.write_jsonl(self.metrics_jsonl)))
+        if self.control_path:
+            services.append(asyncio.create_task(Controller(self, self.control_path).serve()))
+        if self.show_dashboard:
+            services.append(asyncio.create_task(Dashboard(self).run()))
+
+        loop = asyncio.get_running_loop()
+        handled_signals = []
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop_gracefully)
+                handled_signals.append(sig)
+            except (NotImplementedError, RuntimeError):
+                pass  # No signal handlers on this platform; Ctrl+C raises KeyboardInterrupt
 
-def read_credentials():
+        self._force_stop = False
+        self._run_task = asyncio.ensure_future(self.scheduler.run(forever=forever))
+        try:
+            await self._run_task
+        except asyncio.CancelledError:
+            # Cancelled by a second Ctrl+C rather than from outside
+            if not self._force_stop:
+                raise
+        finally:
+            self._run_task = None
+            self._force_stop = False
+            for sig in handled_signals:
+                loop.remove_signal_handler(sig)
+            for service in services:
+                service.cancel()
+            await asyncio.gather(*services, return_exceptions=True)
+            await self.log.stop()
+
+    async def apply_targets(self, targets, previous=None):
+        """Bring the running schedule in line with a target config
+
+        Targets that are unchanged keep running untouched; changed targets are
+        replaced in place and keep their next due time. Returns the targets
+        now in effect: a changed target that fails validation keeps running
+        with its previous settings, and a new one that fails is left out, so
+        both are tried again on the next reload.
+        """
+        previous = previous or {}
+        for chat_id in previous.keys() - targets.keys():
+            self.remove_chat(chat_id)
+            self.log("➖ Removed chat {}", chat_id)
+
+        changed = {chat_id: target for chat_id, target in targets.items()
+                   if previous.get(chat_id) != target}
+        await self.validate_chat_ids(changed)
+        planned = self.schedule_state.plan(
+            ((chat_id, target["interval"]) for chat_id, target in changed.items()
+             if chat_id not in self.scheduler.jobs),
+            {chat_id: target["offset"] for chat_id, target in changed.items()}
+        )
+        applied = dict(targets)
+        for chat_id, target in changed.items():
+            entry = self.scheduler.jobs.get(chat_id)
+            first_due = entry.due if entry is not None else planned[chat_id]
+            added = await self.add_chat(
+                chat_id, target["text"], target["image"], target["interval"], first_due, target["priority"],
+                target["variables"]
+            )
+            if added:
+                continue
+            if entry is not None and chat_id in previous:
+                applied[chat_id] = previous[chat_id]
+                self.log("⚠️ Chat {} keeps its previous settings until its new ones can be applied.", chat_id)
+            else:
+                del applied[chat_id]
+        return applied
+
+    async def watch_config(self, config_path, targets, poll_seconds):
+        """Reload the config whenever it changes on disk"""
+        last_mtime = os.stat(config_path).st_mtime_ns
+        while True:
+            await asyncio.sleep(poll_seconds)
+            try:
+                mtime = os.stat(config_path).st_mtime_ns
+            except OSError:
+                continue
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+
+            print(f"🔄 Config {config_path} changed, reloading...")
+            try:
+                config = load_run_config(config_path)
+                if config is None:
+                    print("⚠️ Keeping the previous config.")
+                    continue
+                if not await self.prepare_media(target["image"] for target in config["targets"].values()):
+                    print("⚠️ Keeping the previous config.")
+                    continue
+                self.retry_policy = RetryPolicy(**config["retry"])
+                applied = await self.apply_targets(config["targets"], targets)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # One bad reload must not end hot reloading for the rest of the run
+                self.log("❌ Reloading {} failed: {}. Will retry on the next change.", config_path, e)
+                continue
+            targets = applied
+            print(f"✅ Config reloaded: {len(targets)} chat(s) scheduled.")
+
+    async def run_from_config(self, config_path):
+        """Send to every target of a config file without any prompts"""
+        config = load_run_config(config_path)
+        if config is None:
+            return False
+        if not await self.check_session():
+            print("❌ No valid session. Run the script interactively once to log in.")
+            return False
+
+        targets = config["targets"]
+        self.retry_policy = RetryPolicy(**config["retry"])
+        if not await self.prepare_media(target["image"] for target in targets.values()):
+            return False
+        print(f"🚀 Starting {len(targets)} chat(s) from {config_path}...")
+        self.log.start()
+        targets = await self.apply_targets(targets)
+
+        watcher = None
+        if config["reload_seconds"]:
+            watcher = asyncio.create_task(self.watch_config(config_path, targets, config["reload_seconds"]))
+        try:
+            await self.run_schedule(forever=watcher is not None)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+        return True
+
+@functools.lru_cache(maxsize=1024)
+def format_interval(seconds):
+    """Format seconds as e.g. '1h 5m 0s' for status output"""
+    hours = seconds // 3600
+    minutes = (seconds % 3600) // 60
+    seconds = seconds % 60
+    if hours > 0:
+        return f"{hours}h {minutes}m {seconds}s"
+    elif minutes > 0:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+def format_offset(seconds):
+    """Format a virtual-time offset as e.g. '+1d 02:03:04'"""
+    days, seconds = divmod(int(seconds), 86400)
+    stamp = time.strftime("%H:%M:%S", time.gmtime(seconds))
+    return f"+{days}d {stamp}" if days else f"+{stamp}"
+
+def parse_interval(value):
+    """Parse an interval given as seconds or as e.g. '90s', '5m', '1h30m'"""
+    if isinstance(value, bool):
+        raise ValueError(f"invalid interval {value!r}")
+    if isinstance(value, (int, float)):
+        seconds = int(value)
+    else:
+        text = str(value).replace(" ", "").lower()
+        if text.isdigit():
+            seconds = int(text)
+        else:
+            match = re.fullmatch(r"(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?", text)
+            if not text or not match:
+                raise ValueError(f"invalid interval {value!r}")
+            hours, minutes, secs = (int(part or 0) for part in match.groups())
+            seconds = hours * 3600 + minutes * 60 + secs
+    if seconds <= 0:
+        raise ValueError(f"interval must be positive, got {value!r}")
+    return seconds
+
+def load_run_config(config_path):
+    """Load and fully validate a headless run config
+
+    The config is a JSON object with a list of "targets". Each target has a
+    "chat" ID and may set "interval", "text" or "message_file" (message
+    templates), "variables" for them, "image", "priority" and a phase
+    "offset" in seconds;
+    missing keys are taken from the optional "defaults" object. Returns None
+    after printing every problem found.
+    """
+    try:
+        with open(config_path, "r", encoding="utf-8") as file:
+            raw = json.load(file)
+    except FileNotFoundError:
+        print(f"❌ Error: Config file '{config_path}' not found.")
+        return None
+    except ValueError as e:
+        print(f"❌ Error: Config file '{config_path}' is not valid JSON: {e}")
+        return None
+
+    if not isinstance(raw, dict):
+        print(f"❌ Config {config_path}: the top level must be a JSON object")
+        return None
+
+    problems = []
+    defaults = raw.get("defaults", {})
+    if not isinstance(defaults, dict):
+        problems.append("defaults must be an object")
+        defaults = {}
+    raw_targets = raw.get("targets", [])
+    if not isinstance(raw_targets, list):
+        problems.append("targets must be a list")
+        raw_targets = []
+    messages = {}
+    targets = {}
+    for i, raw_target in enumerate(raw_targets, 1):
+        if not isinstance(raw_target, dict):
+            problems.append(f"target {i}: must be an object with a \"chat\" key")
+            continue
+        target = {**defaults, **raw_target}
+        chat_id = str(target.get("chat", "")).strip()
+        where = f"target {i} ({chat_id or 'no chat'})"
+        try:
+            TelegramForwarder.parse_chat_id(chat_id)
+        except ValueError:
+            problems.append(f"{where}: invalid chat ID")
+            continue
+        if chat_id in targets:
+            problems.append(f"{where}: chat listed more than once")
+            continue
+
+        try:
+            interval = parse_interval(target.get("interval", 300))
+        except ValueError as e:
+            problems.append(f"{where}: {e}")
+            continue
+
+        text = target.get("text")
+        message_file = target.get("message_file")
+        if text is not None and not isinstance(text, str):
+            problems.append(f"{where}: text must be a string")
+            continue
+        if message_file is not None and not isinstance(message_file, str):
+            problems.append(f"{where}: message_file must be a path")
+            continue
+        try:
+            if text is not None:
+                text = MessageTemplate(text) if text else None
+            elif message_file:
+                if message_file not in messages:
+                    messages[message_file] = MessageTemplate.load(message_file)
+                text = messages[message_file]
+        except ValueError as e:
+            problems.append(f"{where}: invalid message text: {e}")
+            continue
+        if not text:
+            problems.append(f"{where}: no message text")
+            continue
+
+        default_variables, variables = defaults.get("variables", {}), raw_target.get("variables", {})
+        if not isinstance(default_variables, dict) or not isinstance(variables, dict):
+            problems.append(f"{where}: variables must be an object")
+            continue
+        variables = {**default_variables, **variables}
+        if not all(isinstance(value, (str, int, float)) for value in variables.values()):
+            problems.append(f"{where}: variables must be strings or numbers")
+            continue
+        missing = text.missing(variables)
+        if missing:
+            problems.append(f"{where}: no value for {', '.join('{' + field + '}' for field in missing)}")
+            continue
+
+        priority = target.get("priority", 0)
+        if isinstance(priority, bool) or not isinstance(priority, int):
+            problems.append(f"{where}: priority must be a whole number")
+            continue
+
+        image = target.get("image") or None
+        if image is not None and not (
+            isinstance(image, str) or isinstance(image, list) and all(isinstance(path, str) for path in image)
+        ):
+            problems.append(f"{where}: image must be a path or a list of paths")
+            continue
+        if image is not None:
+            # A list of files is sent as an album
+            image = (image,) if isinstance(image, str) else tuple(image)
+            media_problems = MediaCache.check_media(image)
+            if media_problems:
+                problems.extend(f"{where}: {problem}" for problem in media_problems)
+                continue
+
+        offset = target.get("offset")
+        if offset is not None and (isinstance(offset, bool) or not isinstance(offset, (int, float)) or offset < 0):
+            problems.append(f"{where}: offset must be a non-negative number of seconds")
+            continue
+
+        targets[chat_id] = {
+            "interval": interval, "text": text, "variables": variables or None, "image": image,
+            "priority": priority, "offset": offset,
+        }
+
+    retry = raw.get("retry", {})
+    if not isinstance(retry, dict):
+        problems.append("retry must be an object")
+        retry = {}
+    reload_seconds = raw.get("reload_seconds", 5)
+    if isinstance(reload_seconds, bool) or not isinstance(reload_seconds, (int, float)) or reload_seconds < 0:
+        problems.append("reload_seconds must be a non-negative number (0 turns reloading off)")
+    retry_options = list(inspect.signature(RetryPolicy).parameters)
+    for name, value in retry.items():
+        if name not in retry_options:
+            problems.append(f"retry: unknown option '{name}' (expected one of {', '.join(retry_options)})")
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            problems.append(f"retry: '{name}' must be a non-negative number")
+        elif name == "jitter" and value > 1:
+            problems.append("retry: 'jitter' must be between 0 and 1")
+        elif name == "base_delay" and value == 0:
+            problems.append("retry: 'base_delay' must be greater than 0")
+        elif name == "failure_threshold" and value < 1:
+            problems.append("retry: 'failure_threshold' must be at least 1")
+
+    if not targets and not problems:
+        problems.append("no targets configured")
+    for problem in problems:
+        print(f"❌ Config {config_path}: {problem}")
+    if problems:
+        return None
+
+    return {
+        "targets": targets,
+        "reload_seconds": reload_seconds,
+        "retry": retry,
+    }
+
+async def ainput(prompt=""):
+    """input() that keeps the event loop running meanwhile
+
+    The read runs in a daemon thread rather than the default executor, so
+    Ctrl+C at a prompt exits at once instead of waiting for Enter.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def deliver(result, error):
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def read():
+        result, error = None, None
+        try:
+            result = input(prompt)
+        except Exception as e:  # EOFError when stdin is closed
+            error = e
+        try:
+            loop.call_soon_threadsafe(deliver, result, error)
+        except RuntimeError:
+            pass  # The loop is gone; nobody is waiting for this line
+
+    threading.Thread(target=read, daemon=True).start()
+    return await future
+
+def load_json(path, default):
+    """Load a JSON state file, falling back to default if missing or corrupt"""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return default
+
+def save_json(path, data):
+    """Atomically replace a JSON state file"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+def load_jsonl(path, key):
+    """Load a JSONL file into a dict keyed by the given field"""
+    records = {}
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record[key]] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+def read_credentials(quiet=False):
     try:
         with open("credentials.txt", "r") as file:
-            lines = file.readlines()
-            api_id = lines[0].strip()
-            api_hash = lines[1].strip()
-            phone_number = lines[2].strip()
-            return api_id, api_hash, phone_number
+            lines = file.read().split("\n", 3)
     except FileNotFoundError:
-        print("❌Credentials file not found.")
+        if not quiet:
+            print("❌Credentials file not found.")
+        return None, None, None
+    if len(lines) < 3:
+        if not quiet:
+            print("❌Credentials file is incomplete.")
         return None, None, None
+    return lines[0].strip(), lines[1].strip(), lines[2].strip()
 
 def write_credentials(api_id, api_hash, phone_number):
     with open("credentials.txt", "w") as file:
@@ -236,16 +2539,16 @@ def read_text_from_file(file_path):
         print(f"❌ Error reading file '{file_path}': {e}")
         return None
 
-def show_login_menu():
+async def show_login_menu():
     """Show login menu options"""
     print("\n🔐 LOGIN REQUIRED")
     print("You need to login first before using other features.")
     print("\nChoose an option:")
     print("1. Login to Telegram")
     print("2. Exit")
-    return input("Enter your choice: ").strip()
+    return (await ainput("Enter your choice: ")).strip()
 
-def show_main_menu():
+async def show_main_menu():
     """Show main menu options"""
     print("\nAUTOMATIC SENDER TOOLS BY dippfles 😒👌")
     print("Choose an option:")
@@ -254,9 +2557,22 @@ def show_main_menu():
     print("3. Send Message from Text File to Multiple Chats with Custom Intervals")
     print("4. Logout")
     print("5. Exit")
-    return input("Enter your choice: ").strip()
+    return (await ainput("Enter your choice: ")).strip()
 
-def get_time_interval_for_chat(chat_id):
+async def ask_image_paths():
+    """Ask for one image path, or several comma separated paths to send as an album"""
+    paths = [path.strip() for path in (await ainput("🏳️Enter the image file path (comma separated for an album): ")).split(",")]
+    paths = [path for path in paths if path]
+    # Validate image paths
+    problems = MediaCache.check_media(paths) if paths else ["no file given"]
+    if problems:
+        for problem in problems:
+            print(f"⚠️ Warning: Image {problem}.")
+        print("Continuing with text only.")
+        return None
+    return paths[0] if len(paths) == 1 else tuple(paths)
+
+async def get_time_interval_for_chat(chat_id):
     """Get custom time interval for a specific chat"""
     print(f"\n⏰ Set time interval for Chat ID: {chat_id}")
     print("1. Enter in seconds")
@@ -264,29 +2580,29 @@ def get_time_interval_for_chat(chat_id):
     print("3. Enter in hours")
     print("4. Custom (hours, minutes, seconds)")
     
-    choice = input(f"Enter choice for {chat_id} (1-4): ").strip()
+    choice = (await ainput(f"Enter choice for {chat_id} (1-4): ")).strip()
     
     if choice == "1":
-        seconds = int(input(f"Enter interval in seconds for {chat_id}: "))
+        seconds = int(await ainput(f"Enter interval in seconds for {chat_id}: "))
         return seconds
     elif choice == "2":
-        minutes = int(input(f"Enter interval in minutes for {chat_id}: "))
+        minutes = int(await ainput(f"Enter interval in minutes for {chat_id}: "))
         return minutes * 60
     elif choice == "3":
-        hours = int(input(f"Enter interval in hours for {chat_id}: "))
+        hours = int(await ainput(f"Enter interval in hours for {chat_id}: "))
         return hours * 3600
     elif choice == "4":
-        hours = int(input(f"Enter hours for {chat_id} (0 if none): ") or "0")
-        minutes = int(input(f"Enter minutes for {chat_id} (0 if none): ") or "0")
-        seconds = int(input(f"Enter seconds for {chat_id} (0 if none): ") or "0")
+        hours = int(await ainput(f"Enter hours for {chat_id} (0 if none): ") or "0")
+        minutes = int(await ainput(f"Enter minutes for {chat_id} (0 if none): ") or "0")
+        seconds = int(await ainput(f"Enter seconds for {chat_id} (0 if none): ") or "0")
         return hours * 3600 + minutes * 60 + seconds
     else:
         print("Invalid choice, defaulting to 5 minutes")
         return 300
 
-def setup_chat_configs():
+async def setup_chat_configs():
     """Setup chat configurations with individual time intervals"""
-    destination_chat_ids = input("🪄Enter destination chat IDs (comma separated): ").split(",")
+    destination_chat_ids = (await ainput("🪄Enter destination chat IDs (comma separated): ")).split(",")
     chat_configs = {}
     
     print(f"\n📋 Setting up intervals for {len(destination_chat_ids)} chat(s)...")
@@ -303,12 +2619,12 @@ def setup_chat_configs():
         print(f"Chat ID: {chat_id}")
         
         # Ask user if they want to continue with this chat ID
-        confirm = input(f"Continue with this Chat ID? (y/n): ").strip().lower()
+        confirm = (await ainput(f"Continue with this Chat ID? (y/n): ")).strip().lower()
         if confirm != 'y':
             print(f"Skipping Chat ID: {chat_id}")
             continue
             
-        interval = get_time_interval_for_chat(chat_id)
+        interval = await get_time_interval_for_chat(chat_id)
         chat_configs[chat_id] = interval
         valid_chats.append(chat_id)
         
@@ -338,27 +2654,36 @@ async def main():
 
     if api_id is None or api_hash is None or phone_number is None:
         print("🔧 INITIAL SETUP")
-        api_id = input("🔑Enter your API ID: ")
-        api_hash = input("🔑Enter your API Hash: ")
-        phone_number = input("🔑Enter your phone number (with country code): ")
+        api_id = await ainput("🔑Enter your API ID: ")
+        api_hash = await ainput("🔑Enter your API Hash: ")
+        phone_number = await ainput("🔑Enter your phone number (with country code): ")
         write_credentials(api_id, api_hash, phone_number)
         print("✅ Credentials saved!")
 
     forwarder = TelegramForwarder(api_id, api_hash, phone_number)
+    forwarder.show_dashboard = sys.stdout.isatty()
     
-    # Check if session exists and is valid
+    # Check if session exists and is valid; a session that checked out before
+    # is trusted right away and confirmed with the server behind the menu
     session_exists = check_session_file_exists(phone_number)
     session_valid = False
+    session_check = None
     
     if session_exists:
-        print("📱 Checking existing session...")
-        session_valid = await forwarder.check_session()
+        account = forwarder.cached_session()
+        if account is not None:
+            print(f"✅ Logged in as: {account['first_name']} (@{account['username'] or 'No username'})")
+            session_check = asyncio.create_task(forwarder.verify_session())
+            session_valid = True
+        else:
+            print("📱 Checking existing session...")
+            session_valid = await forwarder.check_session()
     
     # Main application loop
     while True:
         if not session_valid:
             # Show login menu
-            choice = show_login_menu()
+            choice = await show_login_menu()
             
             if choice == "1":
                 if await forwarder.login():
@@ -373,35 +2698,41 @@ async def main():
                 print("❌ Invalid choice. Please try again.")
         else:
             # Show main menu
-            choice = show_main_menu()
+            choice = await show_main_menu()
+            if session_check is not None and choice in ("1", "2", "3"):
+                verified = await session_check
+                session_check = None
+                if verified is False:
+                    print("❌ The saved session is no longer authorized. Please log in again.")
+                    session_valid = False
+                    continue
             
             if choice == "1":
                 print("\n📋 LISTING CHATS...")
-                await forwarder.list_chats()
+                incremental = False
+                if os.path.exists(f"chats_of_{phone_number}.jsonl"):
+                    incremental = (await ainput("🔄 Only refresh chats that changed since the last listing? (y/n): ")).strip().lower() == 'y'
+                await forwarder.list_chats(incremental=incremental)
                 
             elif choice == "2":
                 print("\n🚀 MESSAGE SENDER...")
                 # Setup chat configurations with individual intervals
-                chat_configs = setup_chat_configs()
+                chat_configs = await setup_chat_configs()
                 
                 if chat_configs is None:
                     print("❌ No chat configurations available.")
                     continue
                 
-                text = input("\n📝Enter the text to send: ")
+                text = await ainput("\n📝Enter the text to send: ")
                 
-                send_image = input("🏳️Do you want to send an image? (yes/no): ").strip().lower()
+                send_image = (await ainput("🏳️Do you want to send an image? (yes/no): ")).strip().lower()
                 image_path = None
                 if send_image == "yes":
-                    image_path = input("🏳️Enter the image file path: ").strip()
-                    # Validate image path
-                    if not os.path.exists(image_path):
-                        print(f"⚠️ Warning: Image file '{image_path}' not found. Continuing with text only.")
-                        image_path = None
+                    image_path = await ask_image_paths()
 
                 print(f"\n🚀 Starting to send messages to {len(chat_configs)} chat(s) with different intervals...")
                 print("💡 Note: Invalid chat IDs will be automatically skipped after validation")
-                print("Press Ctrl+C to stop all sending tasks")
+                print("Press Ctrl+C to stop all sending tasks (in-flight sends finish first)")
                 
                 try:
                     await forwarder.send_message_periodically_multi_interval(chat_configs, text, image_path)
@@ -411,43 +2742,41 @@ async def main():
             elif choice == "3":
                 print("\n📄 MESSAGE SENDER FROM TEXT FILE...")
                 # Setup chat configurations with individual intervals
-                chat_configs = setup_chat_configs()
+                chat_configs = await setup_chat_configs()
                 
                 if chat_configs is None:
                     print("❌ No chat configurations available.")
                     continue
                 
                 # Get text file path
-                file_path = input("\n📁Enter the path to your text file (.txt): ").strip()
+                file_path = (await ainput("\n📁Enter the path to your text file (.txt): ")).strip()
                 
-                # Read text from file
-                text = read_text_from_file(file_path)
-                if text is None:
+                # Read text from file as written; edits to it are picked up while sending
+                template = MessageTemplate.load(file_path, verbatim=True)
+                if template is None:
                     print("❌ Could not read text from file. Operation cancelled.")
                     continue
+                text = template.source
                 
                 print(f"✅ Successfully loaded text from file:")
                 print(f"📝 Text preview (first 100 characters): {text[:100]}{'...' if len(text) > 100 else ''}")
                 print(f"📊 Total characters: {len(text)}")
                 
                 # Confirm before sending
-                confirm = input("\n❓Proceed with sending this text? (yes/no): ").strip().lower()
+                confirm = (await ainput("\n❓Proceed with sending this text? (yes/no): ")).strip().lower()
                 if confirm != "yes":
                     print("❌ Operation cancelled.")
                     continue
                 
-                send_image = input("🏳️Do you want to send an image with the text? (yes/no): ").strip().lower()
+                send_image = (await ainput("🏳️Do you want to send an image with the text? (yes/no): ")).strip().lower()
                 image_path = None
                 if send_image == "yes":
-                    image_path = input("🏳️Enter the image file path: ").strip()
-                    # Validate image path
-                    if not os.path.exists(image_path):
-                        print(f"⚠️ Warning: Image file '{image_path}' not found. Continuing with text only.")
-                        image_path = None
+                    image_path = await ask_image_paths()
+                text = template
 
                 print(f"\n🚀 Starting to send messages from file to {len(chat_configs)} chat(s) with different intervals...")
                 print("💡 Note: Invalid chat IDs will be automatically skipped after validation")
-                print("Press Ctrl+C to stop all sending tasks")
+                print("Press Ctrl+C to stop all sending tasks (in-flight sends finish first)")
                 
                 try:
                     await forwarder.send_message_periodically_multi_interval(chat_configs, text, image_path)
@@ -456,14 +2785,19 @@ async def main():
                     
             elif choice == "4":
                 print("\n🚪 LOGOUT...")
+                if session_check is not None:
+                    session_check.cancel()
+                    session_check = None
                 # Delete session file
                 session_file = f"session_{phone_number}.session"
                 try:
-                    if os.path.exists(session_file):
-                        os.remove(session_file)
-                    if os.path.exists(session_file + "-journal"):
-                        os.remove(session_file + "-journal")
+                    for path in (session_file, session_file + "-journal", session_file + "-wal",
+                                 session_file + "-shm"):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    forwarder.remember_session(None)
                     print("✅ Logged out successfully!")
+                    forwarder.connection.authorized = False
                     session_valid = False
                 except Exception as e:
                     print(f"⚠️ Error during logout: {e}")
@@ -477,5 +2811,134 @@ async def main():
                 
         print()  # Add blank line for better readability
 
+def simulate_config(args):
+    """Dry-run a config's schedule on a virtual clock and print its load profile"""
+    config = load_run_config(args.config)
+    if config is None:
+        return 1
+    targets = {chat_id: target["interval"] for chat_id, target in config["targets"].items()}
+    offsets = {chat_id: target["offset"] for chat_id, target in config["targets"].items()}
+    duration = args.days * 86400
+    simulator = ScheduleSimulator(targets, args.max_per_second, args.max_per_minute)
+
+    start = time.monotonic()
+    current = simulator.profile(simulator.run(duration, offsets))
+    suggested_offsets, suggested = simulator.improve(duration, current)
+    elapsed = time.monotonic() - start
+
+    print(f"🧪 Simulated {len(targets)} target(s) over {args.days:g} day(s) in {elapsed:.1f}s")
+    print(f"   Budget: {args.max_per_second}/s, {args.max_per_minute}/min")
+    print(f"   {'':<22}{'current':>16}" + (f"{'suggested':>16}" if suggested else ""))
+    for label, key in (
+        ("sends", "sends"), ("avg per second", "avg_per_second"),
+        ("peak per second", "peak_per_second"), ("peak per minute", "peak_per_minute"),
+        ("collisions", "collisions"), ("seconds over budget", "seconds_over_budget"),
+        ("minutes over budget", "minutes_over_budget"),
+    ):
+        print(f"   {label:<22}{current[key]!s:>16}" + (f"{suggested[key]!s:>16}" if suggested else ""))
+    print(f"   Peak second at {current['peak_second_at']}, peak minute at {current['peak_minute_at']}")
+    if current["avg_per_second"] * 60 > args.max_per_minute:
+        print("⚠️ The average load alone is over the per-minute budget; offsets can't fix that, longer intervals can.")
+    if current["worst_minutes"]:
+        print("⚠️ Busiest minutes over budget:")
+        for at, count in current["worst_minutes"]:
+            print(f"   {at}  {count} sends")
+    else:
+        print("✅ No minute exceeds the budget.")
+    if suggested is None:
+        print("✅ No suggested offsets lower the peak; the current ones are kept.")
+
+    if args.write_config:
+        if suggested is None:
+            print(f"⚠️ Not writing {args.write_config}: there are no better offsets to write.")
+            return 0
+        with open(args.config, "r", encoding="utf-8") as file:
+            raw = json.load(file)
+        for target in raw.get("targets", []):
+            chat_id = str(target.get("chat", "")).strip()
+            if chat_id in suggested_offsets:
+                target["offset"] = suggested_offsets[chat_id]
+        with open(args.write_config, "w", encoding="utf-8") as file:
+            json.dump(raw, file, indent=2)
+        print(f"💾 Wrote config with suggested offsets to {args.write_config}")
+    return 0
+
+async def run_command(args):
+    """Run a non-interactive command using saved credentials and session"""
+    if args.command == "ctl" and args.socket:
+        phone_number = None  # Nothing else to look up
+    else:
+        api_id, api_hash, phone_number = read_credentials(quiet=True)
+        if api_id is None or api_hash is None or phone_number is None:
+            print("❌ Run the script without arguments once to set up credentials.")
+            return 1
+
+    if args.command == "ctl":
+        path = args.socket or f"control_{phone_number}.sock"
+        try:
+            reply = await send_control_command(path, " ".join(args.ctl_command))
+        except (FileNotFoundError, ConnectionRefusedError):
+            print(f"❌ No running sender found at {path}.")
+            return 1
+        print(reply)
+        return 0 if not reply.startswith("error") else 1
+
+    forwarder = TelegramForwarder(api_id, api_hash, phone_number)
+    try:
+        if args.command == "run":
+            forwarder.metrics_port = args.metrics_port
+            forwarder.metrics_jsonl = args.metrics_jsonl
+            forwarder.show_dashboard = args.dashboard
+            if args.control:
+                forwarder.control_path = args.control
+            ok = await forwarder.run_from_config(args.config)
+        else:
+            ok = await forwarder.check_session()
+            if ok:
+                await forwarder.list_chats(incremental=args.incremental)
+    finally:
+        await forwarder.client.disconnect()
+    return 0 if ok else 1
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Send messages to multiple Telegram chats on custom intervals.")
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="send to the targets of a config file without prompts")
+    run_parser.add_argument("--config", "-c", required=True, help="path to the JSON run config")
+    run_parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    run_parser.add_argument("--metrics-jsonl", help="append a metrics snapshot to this file every 10 seconds")
+    run_parser.add_argument("--dashboard", action="store_true", help="show a live status view instead of log lines")
+    run_parser.add_argument("--control", help="control socket path (default: control_<phone>.sock)")
+
+    list_parser = commands.add_parser("list", help="export chats and forum topics")
+    list_parser.add_argument("--incremental", action="store_true",
+                             help="only refetch chats that changed since the last listing")
+
+    ctl_parser = commands.add_parser("ctl", help="control a running sender: " + Controller.COMMANDS)
+    ctl_parser.add_argument("--socket", help="control socket path (default: control_<phone>.sock)")
+    ctl_parser.add_argument("ctl_command", nargs="+", metavar="COMMAND")
+
+    simulate_parser = commands.add_parser("simulate", help="dry-run a config's schedule and report its load")
+    simulate_parser.add_argument("--config", "-c", required=True, help="path to the JSON run config")
+    simulate_parser.add_argument("--days", type=float, default=7, help="how much schedule to simulate")
+    simulate_parser.add_argument("--max-per-second", type=int, default=3, help="send budget per second")
+    simulate_parser.add_argument("--max-per-minute", type=int, default=60, help="send budget per minute")
+    simulate_parser.add_argument("--write-config", metavar="PATH",
+                                 help="write a copy of the config with suggested offsets")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.command is None:
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            print("\n👋 Goodbye!")
+    elif args.command == "simulate":
+        raise SystemExit(simulate_config(args))
+    else:
+        try:
+            raise SystemExit(asyncio.run(run_command(args)))
+        except KeyboardInterrupt:
+            print("\n⏹️ Stopped by user.")
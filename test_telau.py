@@ -0,0 +1,572 @@
+"""Unit tests for the scheduling and persistence building blocks of telau
+
+No Telegram account or network is needed:
+
+    python -m pytest -q test_telau.py
+"""
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import types
+import unittest
+
+import telau
+
+
+class SendSchedulerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_job_removed_while_queued_does_not_run(self):
+        scheduler = telau.SendScheduler(workers=1)
+        ran = []
+
+        async def job_a():
+            ran.append("a")
+            scheduler.remove("b")  # b is already queued behind a
+            await asyncio.sleep(0.01)
+            return False
+
+        async def job_b():
+            ran.append("b")
+            return False
+
+        scheduler.add("a", 60, job_a, first_due=0)
+        scheduler.add("b", 60, job_b, first_due=0)
+        await asyncio.wait_for(scheduler.run(), 2)
+        self.assertEqual(ran, ["a"])
+
+    async def test_unexpected_job_errors_go_to_the_status_log(self):
+        stream = io.StringIO()
+        scheduler = telau.SendScheduler(workers=1, log=telau.StatusLog(stream=stream))
+
+        async def broken():
+            raise RuntimeError("boom")
+
+        scheduler.add("a", 60, broken, first_due=0)
+        run = asyncio.create_task(scheduler.run(forever=True))
+        while not stream.getvalue():
+            await asyncio.sleep(0.01)
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+        self.assertIn("❌ Unexpected error in job for a: boom", stream.getvalue())
+
+    async def test_clear_forgets_queued_sends(self):
+        scheduler = telau.SendScheduler(workers=1)
+        scheduler.add("a", 60, None, first_due=0)
+        scheduler._queue.put_nowait(scheduler.jobs["a"])
+        scheduler.clear()
+        self.assertTrue(scheduler._queue.empty())
+        self.assertEqual(scheduler.jobs, {})
+
+    async def test_cancelled_run_keeps_queued_sends_due(self):
+        scheduler = telau.SendScheduler(workers=1)
+        ran = []
+        started = asyncio.Event()
+
+        async def slow():
+            ran.append("slow")
+            started.set()
+            await asyncio.sleep(10)
+
+        async def quick():
+            ran.append("quick")
+
+        scheduler.add("slow", 60, slow, first_due=0)
+        scheduler.add("quick", 60, quick, first_due=0)
+        run = asyncio.create_task(scheduler.run(forever=True))
+        await started.wait()
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+
+        self.assertEqual(ran, ["slow"])
+        self.assertTrue(scheduler._queue.empty())
+        self.assertIsNotNone(scheduler.next_due())  # quick is back on the heap, not lost
+
+    async def test_fixed_rate_skips_missed_ticks(self):
+        clock = telau.VirtualClock(100.0)
+        scheduler = telau.SendScheduler(clock=clock)
+        entry = scheduler.add("a", 10, None, first_due=50.0)
+        scheduler._heap.clear()
+        scheduler._reschedule(entry, None)
+        self.assertEqual(entry.due, 110.0)
+
+    async def test_job_result_controls_rescheduling(self):
+        clock = telau.VirtualClock(0.0)
+        scheduler = telau.SendScheduler(clock=clock)
+        entry = scheduler.add("a", 10, None, first_due=0.0)
+        scheduler._heap.clear()
+        scheduler._reschedule(entry, 3)
+        self.assertEqual(entry.due, 3)
+        scheduler._reschedule(entry, False)
+        self.assertNotIn("a", scheduler.jobs)
+
+
+class DialogClient:
+    """Client stand-in with no dialogs that counts get_entity calls"""
+
+    def __init__(self):
+        self.fetched = []
+
+    async def iter_dialogs(self):
+        return
+        yield
+
+    async def get_entity(self, peer_id):
+        self.fetched.append(peer_id)
+        raise ValueError(f"Cannot find any entity corresponding to {peer_id}")
+
+
+class EntityIndexTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_misses_from_bulk_resolve_are_not_fetched_again(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            client = DialogClient()
+            index = telau.EntityIndex(client, telau.StateStore(os.path.join(workdir, "state.log")))
+            await index.resolve_many([1, 2, 3])
+            self.assertEqual(sorted(client.fetched), [1, 2, 3])
+            for peer_id in (1, 2, 3):
+                self.assertIsNone(await index.resolve(peer_id))
+            self.assertEqual(len(client.fetched), 3)
+            await index.resolve(4)
+            self.assertEqual(len(client.fetched), 4)
+
+
+class StateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+        self.path = os.path.join(self.workdir.name, "state.log")
+
+    def test_changes_survive_a_reload(self):
+        store = telau.StateStore(self.path)
+        store.set("schedule", "1", {"next_due": 10})
+        store.set("schedule", "2", {"next_due": 20})
+        store.delete("schedule", "1")
+        store.flush()
+        self.assertEqual(telau.StateStore(self.path).table("schedule"), {"2": {"next_due": 20}})
+
+    def test_cut_short_last_line_is_dropped_and_rewritten(self):
+        store = telau.StateStore(self.path)
+        store.set("media", "abc", {"kind": "photo"})
+        store.flush()
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write('["media", "def", {"ki')
+        store = telau.StateStore(self.path)
+        self.assertEqual(list(store.table("media")), ["abc"])
+        with open(self.path, encoding="utf-8") as file:
+            self.assertTrue(file.read().endswith("\n"))
+
+    def test_log_is_compacted_once_it_grows_past_the_live_entries(self):
+        store = telau.StateStore(self.path, compact_ratio=2.0, compact_min=10)
+        for i in range(30):
+            store.set("schedule", "1", {"next_due": i})
+            store.flush()
+        with open(self.path, encoding="utf-8") as file:
+            self.assertLessEqual(len(file.readlines()), 10)
+        self.assertEqual(telau.StateStore(self.path).table("schedule"), {"1": {"next_due": 29}})
+
+    def test_hooks_run_before_save(self):
+        store = telau.StateStore(self.path)
+        store.hooks.append(lambda: store.set("schedule", "1", {"next_due": 5}))
+        store.save()
+        self.assertEqual(telau.StateStore(self.path).table("schedule"), {"1": {"next_due": 5}})
+
+
+class MediaCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_files_are_hashed_once_in_a_worker_thread(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "photo.jpg")
+            with open(path, "wb") as file:
+                file.write(b"x" * 3_000_000)
+            cache = telau.MediaCache(None, telau.StateStore(os.path.join(workdir, "state.log")))
+            threads = []
+            hash_file = cache._hash_file
+
+            def counting_hash_file(path):
+                threads.append(threading.current_thread())
+                return hash_file(path)
+
+            cache._hash_file = counting_hash_file
+            digests = await asyncio.gather(*(cache.digest(path) for _ in range(5)))
+            self.assertEqual(set(digests), {hashlib.sha256(b"x" * 3_000_000).hexdigest()})
+            self.assertEqual(len(threads), 1)
+            self.assertIsNot(threads[0], threading.main_thread())
+            await cache.digest(path)
+            self.assertEqual(len(threads), 1)
+
+
+class MediaClient:
+    """Client stand-in that takes uploads and can reject the next cached handle it is sent"""
+
+    def __init__(self):
+        self.uploads = set()  # file ids of uploaded files
+        self.sent = []
+        self.reject_next = False
+
+    async def __call__(self, request):
+        self.uploads.add(request.file_id)
+        return True
+
+    async def send_file(self, entity, file):
+        uploaded = isinstance(file, (telau.types.InputFile, telau.types.InputFileBig))
+        if not uploaded and self.reject_next:
+            self.reject_next = False
+            raise telau.errors.FileReferenceExpiredError(request=None)
+        self.sent.append((entity, "upload" if uploaded else "handle"))
+        photo = types.SimpleNamespace(id=len(self.sent), access_hash=7, file_reference=b"ref")
+        return types.SimpleNamespace(photo=photo)
+
+
+class MediaSendTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_handle_is_reused_and_uploaded_again_once_rejected(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "photo.jpg")
+            with open(path, "wb") as file:
+                file.write(b"\xff\xd8" + b"x" * 1000)
+            store_path = os.path.join(workdir, "state.log")
+            client = MediaClient()
+            cache = telau.MediaCache(client, telau.StateStore(store_path))
+            self.assertTrue(await cache.prepare([path]))
+            await cache.send_file(path, entity="chat1")
+            await cache.send_file(path, entity="chat2")
+            cache.store.save()
+
+            store = telau.StateStore(store_path)
+            cache = telau.MediaCache(client, store)
+            client.reject_next = True  # the stored handle has expired
+            await cache.send_file(path, entity="chat3")
+            await cache.send_file(path, entity="chat4")
+
+            self.assertEqual(len(client.uploads), 2)
+            self.assertEqual(client.sent, [
+                ("chat1", "upload"), ("chat2", "handle"), ("chat3", "upload"), ("chat4", "handle"),
+            ])
+            self.assertEqual(len(store.table("media")), 1)
+            store.save()
+            self.assertEqual(len(telau.StateStore(store_path).table("media")), 1)
+
+
+class ScheduleStateTest(unittest.TestCase):
+
+    def test_overdue_targets_catch_up_quickly(self):
+        clock = telau.VirtualClock(1000.0)
+        state = telau.ScheduleState(None, telau.SendScheduler(clock=clock))
+        wall_now = telau.time.time()
+        state.saved = {
+            "overdue": {"next_due": wall_now - 60},
+            "future": {"next_due": wall_now + 120},
+        }
+        first_due = state.plan([("overdue", 86400), ("future", 86400), ("new", 86400), ("other", 86400)])
+        self.assertLessEqual(first_due["overdue"] - 1000.0, 60)
+        self.assertAlmostEqual(first_due["future"] - 1000.0, 120, delta=1)
+        self.assertEqual(first_due["new"], 1000.0)
+        self.assertEqual(first_due["other"], 1000.0 + 43200)
+
+
+class ScheduleSimulatorTest(unittest.TestCase):
+
+    def test_run_counts_every_fixed_rate_send(self):
+        simulator = telau.ScheduleSimulator({"a": 10, "b": 2.5})
+        per_second = simulator.run(30, {"a": 3, "b": 0})
+        self.assertEqual([s for s in range(31) if per_second[s] and s % 10 == 3], [3, 13, 23])
+        self.assertEqual(sum(per_second), 3 + 12)
+        self.assertEqual(per_second[7], 1)  # b fires at 7.5
+
+    def test_tiled_intervals_match_send_by_send_counts(self):
+        targets = {str(i): 7 if i % 3 else 12 for i in range(60)}
+        offsets = {chat_id: (int(chat_id) * 1.37) % 12 for chat_id in targets}
+        duration = 1000.5
+        per_second = telau.ScheduleSimulator(targets).run(duration, offsets)
+        expected = [0] * len(per_second)
+        for chat_id, interval in targets.items():
+            due = offsets[chat_id] % interval
+            while due < duration:
+                expected[int(due)] += 1
+                due += interval
+        self.assertEqual(list(per_second), expected)
+
+    def test_offsets_are_only_suggested_when_they_lower_the_peak(self):
+        simulator = telau.ScheduleSimulator({"a": 60, "b": 60})
+        spread = simulator.profile(simulator.run(600, {"a": 0, "b": 30}))
+        self.assertEqual(simulator.improve(600, spread), (None, None))
+        bunched = simulator.profile(simulator.run(600, {"a": 0, "b": 0}))
+        offsets, profile = simulator.improve(600, bunched)
+        self.assertEqual(profile["peak_per_second"], 1)
+        self.assertNotEqual(offsets["a"], offsets["b"])
+
+
+class RateGovernorTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_waiting_sends_get_tokens_in_priority_order(self):
+        governor = telau.RateGovernor(rate=20, burst=1, max_rate=20)
+        order = []
+
+        async def send(name, priority):
+            await governor.acquire(priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(send(f"low{i}", 0)) for i in range(40)]
+        await asyncio.sleep(0.2)
+        tasks.append(asyncio.create_task(send("high", 10)))
+        while "high" not in order:
+            await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertLessEqual(order.index("high"), 7)
+
+    async def test_flood_wait_freezes_and_slows_down(self):
+        clock = telau.VirtualClock(0.0)
+        governor = telau.RateGovernor(rate=2.0, clock=clock)
+        governor.on_flood_wait(30)
+        self.assertEqual(governor.frozen_until, 30)
+        self.assertEqual(governor.rate, 1.0)
+        self.assertEqual(governor.flood_waits, 1)
+
+
+class ForwarderTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(workdir.name)  # the forwarder keeps its state files in the working directory
+
+    async def test_client_hands_every_flood_wait_to_the_governor(self):
+        forwarder = telau.TelegramForwarder(1, "0" * 32, "123")
+        self.assertEqual(forwarder.client.flood_sleep_threshold, 0)
+
+    async def test_short_flood_wait_freezes_the_account(self):
+        forwarder = telau.TelegramForwarder(1, "0" * 32, "123", client=PingingClient())
+        error = telau.errors.FloodWaitError(request=None, capture=5)
+        self.assertEqual(forwarder.handle_send_error("42", None, error), 5)
+        self.assertGreater(forwarder.governor.frozen_until, forwarder.governor.clock() + 4)
+        self.assertEqual(forwarder.governor.flood_waits, 1)
+
+    async def test_second_stop_ends_the_run_at_once(self):
+        forwarder = telau.TelegramForwarder(1, "0" * 32, "123", client=PingingClient())
+        forwarder.log.stream = io.StringIO()
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(60)
+
+        forwarder.scheduler.add("42", 60, slow, first_due=0)
+        run = asyncio.create_task(forwarder.run_schedule(forever=True))
+        await started.wait()
+        forwarder.stop_gracefully()
+        forwarder.stop_gracefully()
+        await asyncio.wait_for(run, 2)  # returns instead of raising CancelledError
+
+    def target(self, text, interval=60):
+        return {"interval": interval, "text": text, "variables": None, "image": None, "priority": 0, "offset": None}
+
+    def reloading_forwarder(self, *known_chats):
+        forwarder = telau.TelegramForwarder(1, "0" * 32, "123", client=DialogClient())
+        forwarder.log.stream = io.StringIO()
+        for chat in known_chats:
+            forwarder.store.set("entities", str(-chat), {"type": "chat", "id": chat, "access_hash": 0, "forum": False})
+        return forwarder
+
+    async def test_reload_keeps_unchanged_jobs_and_due_times(self):
+        forwarder = self.reloading_forwarder(1, 2, 3)
+        jobs = forwarder.scheduler.jobs
+        applied = await forwarder.apply_targets({"-1": self.target("a"), "-2": self.target("b"), "-3": self.target("c")})
+        before = dict(jobs)
+
+        await forwarder.apply_targets({"-1": self.target("a"), "-2": self.target("B")}, applied)
+        self.assertIs(jobs["-1"], before["-1"])
+        self.assertIsNot(jobs["-2"], before["-2"])
+        self.assertEqual(jobs["-2"].due, before["-2"].due)
+        self.assertNotIn("-3", jobs)
+        self.assertFalse(before["-3"].active)
+
+    async def test_failed_change_keeps_the_previous_target_and_is_retried(self):
+        forwarder = self.reloading_forwarder(1)
+        jobs = forwarder.scheduler.jobs
+        applied = await forwarder.apply_targets({"-1": self.target("a")})
+        running = jobs["-1"]
+        forwarder.entity_index.forget(-1)  # e.g. removed from the group
+
+        config = {"-1": self.target("b"), "-4": self.target("x")}
+        applied = await forwarder.apply_targets(config, applied)
+        self.assertEqual(applied, {"-1": self.target("a")})
+        self.assertIs(jobs["-1"], running)
+        self.assertNotIn("-4", jobs)
+        self.assertIn("Chat -1 keeps its previous settings", forwarder.log.stream.getvalue())
+
+        forwarder.store.set("entities", "-1", {"type": "chat", "id": 1, "access_hash": 0, "forum": False})
+        applied = await forwarder.apply_targets(config, applied)
+        self.assertEqual(applied, {"-1": self.target("b")})
+        self.assertIsNot(jobs["-1"], running)
+
+
+class SendPipelineTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_media_lane_is_capped_and_waiters_start_by_priority(self):
+        pipeline = telau.SendPipeline(max_in_flight=2, media_slots=1)
+        await pipeline.acquire("media")
+        started = []
+
+        async def send(name, lane, priority):
+            await pipeline.acquire(lane, priority)
+            started.append(name)
+
+        media = asyncio.create_task(send("media", "media", 5))
+        await asyncio.sleep(0)
+        self.assertEqual(started, [])  # only one media slot
+        await pipeline.acquire("text")  # the last slot overall
+        low = asyncio.create_task(send("low", "text", 0))
+        high = asyncio.create_task(send("high", "text", 9))
+        await asyncio.sleep(0)
+        pipeline.release("text")
+        await asyncio.sleep(0)
+        self.assertEqual(started, ["high"])
+        pipeline.release("media")
+        await asyncio.gather(media, asyncio.sleep(0))
+        self.assertEqual(started, ["high", "media"])
+        low.cancel()
+        await asyncio.gather(low, return_exceptions=True)
+
+
+class StatusLogTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_errors_are_never_rate_limited(self):
+        stream = io.StringIO()
+        log = telau.StatusLog(rate=20, stream=stream)
+        log.start()
+        for i in range(30):
+            log.routine("🚀Sent message to {}", i)
+        log("❌ No permission to write in chat {}. Stopping this chat.", 7)
+        await asyncio.sleep(0.3)
+        await log.stop()
+        output = stream.getvalue()
+        self.assertIn("Stopping this chat", output)
+        self.assertIn("25 status message(s) suppressed", output)
+
+    async def test_full_queue_drops_routine_lines_not_errors(self):
+        stream = io.StringIO()
+        log = telau.StatusLog(max_pending=100, stream=stream)
+        log.start(period=60)
+        log("❌ No permission to write in chat {}. Stopping this chat.", 7)
+        for i in range(200):
+            log.routine("🚀Sent message to {}", i)
+        self.assertEqual(len(log.pending), 100)
+        await log.stop()
+        output = stream.getvalue()
+        self.assertIn("Stopping this chat", output)
+        self.assertIn("101 status message(s) suppressed", output)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_many_chats_export_only_the_total(self):
+        metrics = telau.Metrics(per_chat_limit=2)
+        for chat_id in ("1", "2", "3"):
+            metrics.observe_send(chat_id, 0.1)
+        text = metrics.render_prometheus()
+        self.assertIn("telau_send_latency_seconds_count 3", text)
+        self.assertNotIn('chat="1"', text)
+
+
+class PingingClient:
+    """Client stand-in that counts raw requests and fails the first one"""
+
+    def __init__(self):
+        self.requests = []
+
+    def is_connected(self):
+        return True
+
+    async def __call__(self, request):
+        self.requests.append(type(request).__name__)
+        if len(self.requests) == 1:
+            raise RuntimeError("unexpected RPC error")
+
+
+class ConnectionManagerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_keepalive_sends_real_requests_and_survives_errors(self):
+        client = PingingClient()
+        connection = telau.ConnectionManager(client, log=lambda *args: None, keepalive_seconds=0.01)
+        connection.ready.set()
+        task = asyncio.create_task(connection.keepalive())
+        for _ in range(500):  # The first ping also imports Telethon
+            if len(client.requests) > 2 or task.done():
+                break
+            await asyncio.sleep(0.01)
+        self.assertFalse(task.done())
+        task.cancel()
+        self.assertGreater(len(client.requests), 2)
+        self.assertEqual(client.requests[0], "GetNearestDcRequest")
+
+
+class MessageTemplateTest(unittest.TestCase):
+
+    def test_placeholders_and_escapes(self):
+        template = telau.MessageTemplate("Hi {name} in {chat} {{ok}}")
+        self.assertEqual(template.render("42", {"name": "Ann"}), "Hi Ann in 42 {ok}")
+        self.assertEqual(template.missing({}), ["name"])
+
+    def test_verbatim_file_keeps_braces_and_is_still_watched(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "message.txt")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write('{"a": 1} }:) {word}')
+            template = telau.MessageTemplate.load(path, verbatim=True)
+        self.assertEqual(template.render("42"), '{"a": 1} }:) {word}')
+        self.assertEqual(template.path, path)
+        self.assertIsNotNone(template.mtime_ns)
+
+
+class LoadRunConfigTest(unittest.TestCase):
+
+    def load(self, raw):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "config.json")
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(raw, file)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                config = telau.load_run_config(path)
+        return config, output.getvalue()
+
+    def test_malformed_shapes_are_reported_not_raised(self):
+        for raw in (
+            [],
+            {"targets": ["123"]},
+            {"targets": {"chat": "123"}},
+            {"defaults": [], "targets": [{"chat": "123", "text": "hi"}]},
+            {"targets": [{"chat": "123", "text": "hi"}], "reload_seconds": "5"},
+            {"targets": [{"chat": "123", "text": "hi", "image": 5}]},
+            {"targets": [{"chat": "123", "text": "hi"}], "retry": []},
+            {"targets": [{"chat": "123", "text": "hi"}], "retry": {"jitter": 1.5}},
+            {"targets": [{"chat": "123", "text": "hi"}], "retry": {"base_delay": 0}},
+            {"targets": [{"chat": "123", "text": "hi"}], "retry": {"failure_threshold": 0.5}},
+        ):
+            config, output = self.load(raw)
+            self.assertIsNone(config, raw)
+            self.assertIn("❌", output)
+
+    def test_valid_config(self):
+        config, _ = self.load({"targets": [{"chat": "-100123/4", "text": "Hi {chat}", "interval": "5m"}]})
+        target = config["targets"]["-100123/4"]
+        self.assertEqual(target["interval"], 300)
+        self.assertEqual(config["reload_seconds"], 5)
+
+    def test_retry_bounds_are_inclusive(self):
+        retry = {"jitter": 1, "base_delay": 0.1, "failure_threshold": 1}
+        config, output = self.load({"targets": [{"chat": "123", "text": "hi"}], "retry": retry})
+        self.assertIsNotNone(config, output)
+
+
+if __name__ == "__main__":
+    unittest.main()